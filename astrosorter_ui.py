@@ -905,4 +905,4 @@ class Ui_mainWindow(object):
         self.menuChangeDirectory.setText(_translate("mainWindow", "Change Base Directory"))
         self.actionSimulate_RHEED.setText(_translate("mainWindow", "Simulate RHEED"))
 
-from . import resources_rc
+import resources_rc
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# Synthetic frame sets for benchmarks: every file carries controlled
+# ExposureTime/ISO/FNumber metadata and bias/dark/light/flat-like pixels, and
+# its expected frame type is written to manifest.json.
+#
+#   python benchmarks/fixtures.py /tmp/frames --count 1000 --format tiff
+#
+# Formats:
+#   tiff  uncompressed RGB TIFF with an EXIF IFD
+#   jpeg  JPEG with an EXIF APP1 segment
+#   cr2   CR2-style TIFF container: EXIF, a JPEG preview in IFD0 and a small
+#         JPEG thumbnail in IFD1 (no raw sensor data, so LibRaw can't open it)
+#   cr3   CR3-style ISO-BMFF container: CMT1/CMT2 metadata and a THMB
+#         thumbnail in moov, a PRVW preview and an mdat of filler bytes
+#   fits  16-bit FITS with EXPTIME/ISOSPEED/FOCRATIO/IMAGETYP header cards
+
+import os
+import io
+import sys
+import json
+import struct
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import cr3, fits
+
+# Settings per frame type; every session (ISO) gets bias, flat and dark/light
+# exposures so the sorter finds exactly three exposure groups per ISO
+EXPOSURES = {'Bias': (1, 4000), 'Flat': (1, 100), 'Dark': (30, 1), 'Light': (30, 1)}
+LEVELS = {'Bias': 2, 'Dark': 4, 'Light': 30, 'Flat': 170}
+MIX = (('Bias', 0.2), ('Flat', 0.2), ('Dark', 0.2), ('Light', 0.4))
+ISOS = (400, 800, 1600)
+FNUMBER = (28, 5)
+FORMATS = ('tiff', 'jpeg', 'cr2', 'cr3', 'fits')
+
+# TIFF field types: (size in bytes, struct format)
+ASCII, SHORT, LONG, RATIONAL, UNDEFINED = 2, 3, 4, 5, 7
+TYPES = {ASCII: (1, None), SHORT: (2, 'H'), LONG: (4, 'I'), RATIONAL: (8, 'II'), UNDEFINED: (1, None)}
+
+class Ref(object):
+    # A LONG value filled in with the offset of another IFD or data blob
+    def __init__(self, key: str):
+        self.key = key
+
+def encode_value(kind: int, value) -> tuple:
+    if kind == ASCII:
+        data = value.encode('ascii') + b'\0'
+        return data, len(data)
+    if kind == UNDEFINED:
+        return value, len(value)
+    values = value if isinstance(value, list) else [value]
+    if kind == RATIONAL:
+        return b''.join(struct.pack('<II', *v) for v in values), len(values)
+    return values, len(values)
+
+def tiff_bytes(ifds: dict, chain: list, blobs: dict = None, prefix: bytes = b'') -> bytes:
+    # ifds maps names to [(tag, type, value)]; the IFDs in `chain` are linked
+    # through their next-IFD pointers, and Ref values point at IFDs or blobs
+    blobs = blobs or {}
+    offsets, offset = {}, 8 + len(prefix)
+    for name, entries in ifds.items():
+        offsets[name] = offset
+        offset += 2 + 12*len(entries) + 4
+        for tag, kind, value in entries:
+            size = TYPES[kind][0] * encode_value(kind, value)[1]
+            offset += size + size % 2 if size > 4 else 0
+    for name, blob in blobs.items():
+        offsets[name] = offset
+        offset += len(blob) + len(blob) % 2
+
+    out = bytearray(b'II*\0' + struct.pack('<I', offsets[chain[0]]) + prefix)
+    for name, entries in ifds.items():
+        entries = sorted(entries, key=lambda entry: entry[0])
+        extra_offset = offsets[name] + 2 + 12*len(entries) + 4
+        table, extra = struct.pack('<H', len(entries)), b''
+        for tag, kind, value in entries:
+            data, count = encode_value(kind, value)
+            if kind in (SHORT, LONG):
+                data = [offsets[v.key] if isinstance(v, Ref) else v for v in data]
+                data = struct.pack(f'<{count}{TYPES[kind][1]}', *data)
+            if len(data) <= 4:
+                table += struct.pack('<HHI', tag, kind, count) + data.ljust(4, b'\0')
+            else:
+                table += struct.pack('<HHII', tag, kind, count, extra_offset + len(extra))
+                extra += data + b'\0'*(len(data) % 2)
+        position = chain.index(name) if name in chain else -1
+        next_ifd = offsets[chain[position+1]] if 0 <= position < len(chain) - 1 else 0
+        out += table + struct.pack('<I', next_ifd) + extra
+    for name, blob in blobs.items():
+        out += blob + b'\0'*(len(blob) % 2)
+    return bytes(out)
+
+def pixels(frame_type: str, width: int, height: int, rng) -> np.ndarray:
+    level = LEVELS[frame_type]
+    im = rng.normal(level, 1 + level*0.02, (height, width, 3))
+    if frame_type == 'Light':
+        # A few saturated stars on a sky background
+        stars = rng.integers(0, width*height, max(1, width*height//200))
+        im.reshape(-1, 3)[stars] = 255
+    return np.clip(im, 0, 255).astype(np.uint8)
+
+def exif_entries(frame_type: str, iso: int, index: int) -> tuple:
+    ifd0 = [
+        (0x010f, ASCII, 'Canon'),
+        (0x0110, ASCII, 'Canon EOS Synthetic'),
+        (0x0132, ASCII, f'2020:10:18 {20 + index//3600 % 4:02d}:{index//60 % 60:02d}:{index % 60:02d}'),
+        ]
+    exif = [
+        (0x829a, RATIONAL, EXPOSURES[frame_type]),
+        (0x829d, RATIONAL, FNUMBER),
+        (0x8822, SHORT, 1),
+        (0x8827, SHORT, iso),
+        (0x920a, RATIONAL, (50, 1)),
+        (0xa001, SHORT, 1),
+        ]
+    return ifd0, exif
+
+def jpeg_bytes(im: np.ndarray, **kwargs) -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(im).save(buf, 'JPEG', quality=90, **kwargs)
+    return buf.getvalue()
+
+def tiff_frame(im: np.ndarray, ifd0: list, exif: list) -> bytes:
+    height, width = im.shape[:2]
+    ifd0 = ifd0 + [
+        (0x0100, LONG, width), (0x0101, LONG, height), (0x0102, SHORT, [8, 8, 8]),
+        (0x0103, SHORT, 1), (0x0106, SHORT, 2), (0x0111, LONG, Ref('pixels')),
+        (0x0115, SHORT, 3), (0x0116, LONG, height), (0x0117, LONG, im.nbytes),
+        (0x8769, LONG, Ref('exif')),
+        ]
+    return tiff_bytes({'ifd0': ifd0, 'exif': exif}, ['ifd0'], {'pixels': im.tobytes()})
+
+def jpeg_frame(im: np.ndarray, ifd0: list, exif: list) -> bytes:
+    ifd0 = ifd0 + [(0x8769, LONG, Ref('exif'))]
+    return jpeg_bytes(im, exif=b'Exif\0\0' + tiff_bytes({'ifd0': ifd0, 'exif': exif}, ['ifd0']))
+
+def cr2_frame(im: np.ndarray, ifd0: list, exif: list) -> bytes:
+    height, width = im.shape[:2]
+    preview = jpeg_bytes(im)
+    thumb = jpeg_bytes(np.ascontiguousarray(im[::4, ::4]))
+    ifd0 = ifd0 + [
+        (0x0100, LONG, width), (0x0101, LONG, height), (0x0103, SHORT, 6),
+        (0x0111, LONG, Ref('preview')), (0x0117, LONG, len(preview)),
+        (0x8769, LONG, Ref('exif')),
+        ]
+    ifd1 = [
+        (0x0103, SHORT, 6), (0x0201, LONG, Ref('thumb')), (0x0202, LONG, len(thumb)),
+        ]
+    # 'CR', version 2.0 and a (missing) raw IFD offset follow the TIFF header
+    return tiff_bytes({'ifd0': ifd0, 'ifd1': ifd1, 'exif': exif}, ['ifd0', 'ifd1'],
+                      {'preview': preview, 'thumb': thumb}, prefix=b'CR\x02\x00\0\0\0\0')
+
+def box(kind: bytes, payload: bytes, uuid: bytes = b'') -> bytes:
+    return struct.pack('>I4s', 8 + len(uuid) + len(payload), kind) + uuid + payload
+
+def cr3_frame(im: np.ndarray, ifd0: list, exif: list) -> bytes:
+    height, width = im.shape[:2]
+    preview = jpeg_bytes(im)
+    thumb = jpeg_bytes(np.ascontiguousarray(im[::4, ::4]))
+    canon = b''.join([
+        box(b'CMT1', tiff_bytes({'ifd0': ifd0}, ['ifd0'])),
+        box(b'CMT2', tiff_bytes({'exif': exif}, ['exif'])),
+        box(b'THMB', struct.pack('>4xHHI4x', width//4, height//4, len(thumb)) + thumb),
+        ])
+    prvw = box(b'PRVW', struct.pack('>4xHHHHI', 1, width, height, 1, len(preview)) + preview)
+    return b''.join([
+        box(b'ftyp', b'crx ' + struct.pack('>I', 1) + b'crx isom'),
+        box(b'moov', box(b'uuid', canon, cr3.CANON_UUID)),
+        box(b'uuid', bytes(8) + prvw, cr3.PREVIEW_UUID),
+        box(b'mdat', bytes(im.nbytes)),
+        ])
+
+def fits_frame(im: np.ndarray, frame_type: str, iso: int, index: int) -> bytes:
+    mono = np.round(im.mean(axis=2) * 256).astype(np.uint16)
+    num, den = EXPOSURES[frame_type]
+    cards = fits.image_cards(mono.shape, 16) + [
+        ('BZERO', 32768), ('BSCALE', 1),
+        ('EXPTIME', num/den), ('ISOSPEED', iso), ('GAIN', iso//100), ('FOCRATIO', FNUMBER[0]/FNUMBER[1]),
+        ('IMAGETYP', f'{frame_type} Frame'), ('INSTRUME', 'Synthetic Mono'),
+        ('DATE-OBS', f'2020-10-18T21:{index//60 % 60:02d}:{index % 60:02d}'),
+        ]
+    data = (mono.astype(np.int32) - 32768).astype('>i2').tobytes()
+    return fits.header_block(cards) + data + b'\0'*(-len(data) % fits.BLOCK)
+
+def frame_types(count: int) -> list:
+    types = []
+    for frame_type, share in MIX:
+        types += [frame_type] * int(round(count*share))
+    types = (types + ['Light']*count)[:count]
+    return types
+
+def generate(folder: str, count: int, fmt: str = 'tiff', width: int = 64,
+             height: int = 48, seed: int = 0) -> dict:
+    # Returns {filepath: expected FrameType}, also saved as manifest.json
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    ext = {'jpeg': 'jpg'}.get(fmt, fmt)
+    types = frame_types(count)
+    rng.shuffle(types)
+    manifest = {}
+    for index, frame_type in enumerate(types):
+        iso = ISOS[index % len(ISOS)]
+        im = pixels(frame_type, width, height, rng)
+        if fmt == 'fits':
+            data = fits_frame(im, frame_type, iso, index)
+        else:
+            ifd0, exif = exif_entries(frame_type, iso, index)
+            data = {'tiff': tiff_frame, 'jpeg': jpeg_frame, 'cr2': cr2_frame,
+                        'cr3': cr3_frame}[fmt](im, ifd0, exif)
+        path = os.path.join(folder, f'IMG_{index:06d}.{ext}')
+        with open(path, 'wb') as f:
+            f.write(data)
+        manifest[path] = frame_type
+    with open(os.path.join(folder, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic astrophotography frames')
+    parser.add_argument('folder')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--format', choices=FORMATS, default='tiff')
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--height', type=int, default=48)
+    parser.add_argument('--seed', type=int, default=0)
+    opts = parser.parse_args()
+    manifest = generate(opts.folder, opts.count, opts.format, opts.width, opts.height, opts.seed)
+    print(f'Wrote {len(manifest)} {opts.format} frames to {opts.folder}')
+
+if __name__ == '__main__':
+    sys.exit(main())
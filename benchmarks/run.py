@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Pipeline benchmark: generates synthetic frame sets (see fixtures.py) and
+# times each stage of the headless engine on them. Results are JSON so runs
+# can be compared across commits.
+#
+#   python benchmarks/run.py --sizes 1000 10000 100000 --output results.json
+#   python benchmarks/run.py --sizes 1000 --format jpeg --workers 4
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fixtures
+from modules import engine
+
+STAGES = ('generate', 'get_pics', 'analyze_pics', 'get_pct_dark', 'sort_pics', 'move_pics')
+
+def timed(fn, *args, **kwargs) -> tuple:
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_size(count: int, opts, workdir: str) -> dict:
+    location = os.path.join(workdir, f'frames_{count}')
+    output = os.path.join(workdir, f'sorted_{count}')
+    quiet = lambda *args: None
+    eng = engine.Engine(notice=quiet, alert=quiet, workers=opts.workers)
+    eng.physical_order = opts.physical_order
+    times = {}
+    try:
+        manifest, times['generate'] = timed(fixtures.generate, location, count, opts.format,
+                                            opts.width, opts.height)
+        pics, times['get_pics'] = timed(eng.get_pics, location)
+        _, times['analyze_pics'] = timed(eng.analyze_pics, pics=pics, classify=opts.classify)
+
+        # get_pct_dark is timed in-process on a sample, sort_pics covers the
+        # pooled classification of every dark/light frame
+        sample = pics[:opts.sample]
+        _, elapsed = timed(lambda: [eng.get_pct_dark(path) for path in sample])
+        times['get_pct_dark'] = elapsed * len(pics) / max(len(sample), 1)
+        df, times['sort_pics'] = timed(eng.sort_pics)
+        _, times['move_pics'] = timed(eng.move_pics, opts.copy, output)
+
+        correct = sum(df.loc[path, 'FrameType'] == frame_type
+                      for path, frame_type in manifest.items() if path in df.index)
+    finally:
+        eng.process_pool.shutdown()
+        if not opts.keep:
+            shutil.rmtree(location, ignore_errors=True)
+            shutil.rmtree(output, ignore_errors=True)
+    return {
+        'files': count,
+        'seconds': {stage: round(times[stage], 4) for stage in STAGES},
+        'files_per_second': {stage: round(count / times[stage], 1) if times[stage] else None
+                             for stage in STAGES},
+        'sorted_correctly': correct,
+        'instrumentation': eng.instruments.report(),
+        'concurrency': eng.instruments.concurrency_report(),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each pipeline stage on synthetic frames')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--format', choices=fixtures.FORMATS, default='tiff')
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--height', type=int, default=48)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (0 runs in-process)')
+    parser.add_argument('--sample', type=int, default=500,
+                        help='files timed in-process for get_pct_dark')
+    parser.add_argument('--copy', action='store_true', help='time copying instead of moving')
+    parser.add_argument('--classify', action='store_true',
+                        help='measure dark fractions while analyzing (sort_pics then decodes nothing)')
+    parser.add_argument('--physical-order', action='store_true',
+                        help='process files in their order on disk')
+    parser.add_argument('--workdir', help='where frames are generated (default: a temp folder)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated frames')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    opts = parser.parse_args()
+
+    workdir = opts.workdir or tempfile.mkdtemp(prefix='astrosorter-bench-')
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'format': opts.format,
+        'frame_size': [opts.width, opts.height],
+        'workers': opts.workers,
+        'copy': opts.copy,
+        'classify': opts.classify,
+        'physical_order': opts.physical_order,
+        'runs': [],
+        }
+    try:
+        for count in opts.sizes:
+            print(f'Benchmarking {count} {opts.format} frames...', file=sys.stderr)
+            results['runs'].append(run_size(count, opts, workdir))
+    finally:
+        if not opts.workdir and not opts.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# Cold start benchmark: launches AstroSorter until its window is shown and
+# compares the default fast start with the old --rebuild path (pyqt5ac plus
+# runtime .ui parsing). --importtime reports which imports the fast start
+# still pays for before the first paint (python -X importtime).
+#
+#   python benchmarks/startup.py --runs 5
+#   python benchmarks/startup.py --importtime
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'astrosorter.py')
+MODES = {
+    'fast start': [],
+    'rebuild (before)': ['--rebuild'],
+    }
+
+def time_launch(args: list) -> float:
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, SCRIPT, '--quit-after-show', *args],
+                   cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+def import_profile(top: int = 20) -> list:
+    # Each stderr line is 'import time: self [us] | cumulative | imported package'
+    proc = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT, '--quit-after-show'],
+                          cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Only report top-level imports (nested ones are indented)
+        if not name.startswith('  '):
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description='Time AstroSorter cold starts')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--importtime', action='store_true',
+                        help='report the slowest imports before the first paint')
+    opts = parser.parse_args()
+    
+    if opts.importtime:
+        rows = import_profile()
+        if opts.json:
+            return print(json.dumps([dict(zip(('module', 'self_us', 'cumulative_us'), row))
+                                     for row in rows], indent=2))
+        print(f'{"Module":<40}{"Self":>12}{"Cumulative":>14}')
+        for name, self_us, cumulative_us in rows:
+            print(f'{name:<40}{self_us/1000:>9.1f} ms{cumulative_us/1000:>11.1f} ms')
+        return
+    
+    results = {}
+    for mode, args in MODES.items():
+        times = [time_launch(args) for _ in range(opts.runs)]
+        results[mode] = {'runs': opts.runs, 'min': min(times),
+                         'median': statistics.median(times), 'max': max(times)}
+    
+    if opts.json:
+        return print(json.dumps(results, indent=2))
+    for mode, res in results.items():
+        print(f"{mode:>18}: median {res['median']:.3f} s "
+              f"(min {res['min']:.3f} s, max {res['max']:.3f} s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Accuracy check for micro classification: tells dark from light frames on a
+# labelled set once from the full preview and once from the smallest embedded
+# image (formats.MICRO_SIZE), and reports accuracy, agreement, time and decoded
+# size per frame for both. Labels come from outside the sorter, so its own
+# mistakes don't count as correct: the manifest fixtures.py writes, or a CSV
+# of filepath,Dark/Light rows checked by hand (relative paths are relative to
+# the CSV).
+#
+#   python benchmarks/thumbnails.py /tmp/frames              # fixtures.py manifest
+#   python benchmarks/thumbnails.py --labels checked.csv --json
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules import instrument, tasks
+
+MODES = {'full': False, 'micro': True}
+
+def labelled_frames(opts) -> dict:
+    # {filepath: 'Dark' or 'Light'} from a fixtures manifest or a labels CSV
+    # (rows with any other label, such as a header, are skipped)
+    if opts.labels:
+        folder = os.path.dirname(os.path.abspath(opts.labels))
+        with open(opts.labels, newline='') as f:
+            labels = {os.path.join(folder, row[0]): row[1].strip()
+                      for row in csv.reader(f) if len(row) >= 2}
+    else:
+        with open(os.path.join(opts.folder, 'manifest.json')) as f:
+            labels = json.load(f)
+    return {path: label for path, label in labels.items() if label in ('Dark', 'Light')}
+
+def classify(paths: list, micro: bool, threshold: int) -> tuple:
+    # Untimed first decode, so lazy imports aren't counted
+    if paths:
+        try:
+            tasks.pct_dark(paths[0], threshold, micro)
+        except Exception:
+            pass
+    instrument.local.reset()
+    fractions, t0 = {}, time.perf_counter()
+    for path in paths:
+        try:
+            fractions[path] = tasks.pct_dark(path, threshold, micro)
+        except Exception as ex:
+            print(f'Could not load {path} ({ex})', file=sys.stderr)
+    seconds = time.perf_counter() - t0
+    decoded = instrument.local.report().get('thumbnail_decode', {}).get('bytes', 0)
+    return fractions, seconds, decoded
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare micro and full preview classification')
+    parser.add_argument('folder', nargs='?', help='frames generated by fixtures.py')
+    parser.add_argument('--labels', help='CSV of filepath,Dark/Light rows checked by hand')
+    parser.add_argument('--threshold', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    opts = parser.parse_args()
+    if not opts.folder and not opts.labels:
+        parser.error('requires a fixtures folder or --labels')
+
+    labels = labelled_frames(opts)
+    paths = sorted(labels)
+    dark_or_light = lambda pct: 'Dark' if pct > 0.99 else 'Light'
+    results, predictions = {'frames': len(paths)}, {}
+    for mode, micro in MODES.items():
+        fractions, seconds, decoded = classify(paths, micro, opts.threshold)
+        predictions[mode] = {path: dark_or_light(pct) for path, pct in fractions.items()}
+        correct = sum(predictions[mode][path] == labels[path] for path in predictions[mode])
+        results[mode] = {
+            'accuracy': round(correct / max(len(paths), 1), 4),
+            'ms_per_frame': round(seconds * 1000 / max(len(paths), 1), 3),
+            'decoded_kb_per_frame': round(decoded / 1024 / max(len(paths), 1), 1),
+            }
+    both = [path for path in paths if path in predictions['full'] and path in predictions['micro']]
+    disagree = [path for path in both if predictions['full'][path] != predictions['micro'][path]]
+    results['agreement'] = round(1 - len(disagree) / max(len(both), 1), 4)
+    results['disagreements'] = disagree[:20]
+
+    if opts.json:
+        return print(json.dumps(results, indent=2))
+    print(f'{len(paths)} labelled dark/light frames')
+    for mode in MODES:
+        row = results[mode]
+        print(f'{mode:>6}: accuracy {row["accuracy"]:.2%}, {row["ms_per_frame"]:.2f} ms and '
+              f'{row["decoded_kb_per_frame"]:.1f} KB decoded per frame')
+    print(f' agree: {results["agreement"]:.2%}')
+    for path in disagree[:20]:
+        print(f'  {path}: full {predictions["full"][path]}, micro {predictions["micro"][path]}')
+
+if __name__ == '__main__':
+    sys.exit(main())
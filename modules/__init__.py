@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+# Headless commands (see cli.py) and their help. astrosorter.py routes them
+# to the command line from here, without importing cli.py before running it
+# as __main__
+COMMANDS = {
+    'analyze': 'read metadata of every picture in a folder',
+    'sort': 'determine the frame type of every analyzed picture',
+    'process': 'analyze, sort and move in one streaming pass',
+    'move': 'move sorted pictures into frame type folders',
+    'watch': 'sort pictures into folders as they are captured',
+    'verify': 'check verified copies against their stored checksums',
+    'stack': 'build master bias/dark/flat frames for every image group',
+    }
@@ -19,8 +19,9 @@ def buttons(self):
     self.selectOutputFolderButton.clicked.connect(self.select_output_folder)
 
 def tables(self):
-    fill = QHeaderView.ResizeToContents
-    self.fileTable.horizontalHeader().setSectionResizeMode(fill)
+    # Columns are sized explicitly from a sample of rows (see resize_file_table)
+    self.fileTable.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+    self.fileTable.horizontalHeader().setResizeContentsPrecision(200)
     self.fileTable.horizontalHeader().setMinimumHeight(32)
     
 def checkboxes(self):
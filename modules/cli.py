@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Headless command line for the picture pipeline; never imports Qt, so it
+# works over SSH or from cron on machines without a display server.
+#
+#   python astrosorter.py analyze /captures/2020-10-18 --workers 4
+#   python astrosorter.py sort --json
+#   python astrosorter.py move /sorted --copy
+#   python astrosorter.py process /captures/2020-10-18 /sorted --copy
+#   python astrosorter.py watch /captures/tonight /sorted --workers 1
+#   python astrosorter.py verify
+#   python astrosorter.py stack --method sigma
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+
+from . import COMMANDS
+from .engine import Engine, CancelToken
+from .instrument import profile
+
+CATALOG = 'photo info.pkl'
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='astrosorter',
+                                     description='Sort astrophotography frames without the GUI')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--catalog', default=CATALOG,
+                        help=f'picture catalog shared between commands (default: {CATALOG!r})')
+    common.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU, 0 runs in-process)')
+    common.add_argument('--no-readahead', dest='readahead', action='store_false',
+                        help="don't prefetch the next files while one is parsed")
+    common.add_argument('--physical-order', action='store_true',
+                        help='process files in their order on disk (for HDD archives)')
+    common.add_argument('--fixed-concurrency', dest='adaptive', action='store_false',
+                        help='keep two chunks per worker in flight instead of adapting to the storage')
+    common.add_argument('--json', action='store_true',
+                        help='print a JSON summary to stdout (messages go to stderr)')
+    common.add_argument('--stats', action='store_true',
+                        help='print per-stage timings (p50/p95/max per file, bytes read) to stderr')
+    common.add_argument('--profile', metavar='PATH',
+                        help='dump a cProfile of the run to PATH (combine with --workers 0 '
+                             'to include the picture work)')
+    
+    commands = parser.add_subparsers(dest='command', required=True)
+    parsers = {name: commands.add_parser(name, parents=[common], help=text)
+               for name, text in COMMANDS.items()}
+    analyze = parsers['analyze']
+    analyze.add_argument('input', help='folder to search for pictures')
+    analyze.add_argument('--classify', action='store_true',
+                         help='measure dark fractions while reading metadata (one read per file)')
+    analyze.add_argument('--micro', action='store_true',
+                         help='with --classify: use the smallest embedded image of each picture')
+    sort = parsers['sort']
+    sort.add_argument('--micro', action='store_true',
+                      help='tell darks from lights by the smallest embedded image of each picture')
+    process = parsers['process']
+    process.add_argument('input', help='folder to search for pictures')
+    process.add_argument('output', help='folder to move the sorted pictures into')
+    process.add_argument('--copy', action='store_true', help='copy instead of moving')
+    process.add_argument('--verify', action='store_true',
+                         help='with --copy: read every copy back and compare checksums')
+    process.add_argument('--micro', action='store_true',
+                         help='tell darks from lights by the smallest embedded image of each picture')
+    process.add_argument('--ingest-workers', type=int,
+                         help='chunks of pictures read at a time (default: adaptive)')
+    process.add_argument('--transfer-workers', type=int,
+                         help='chunks of pictures moved at a time (default: adaptive)')
+    move = parsers['move']
+    move.add_argument('output', help='folder to move the sorted pictures into')
+    move.add_argument('--copy', action='store_true', help='copy instead of moving')
+    move.add_argument('--verify', action='store_true',
+                      help='check each copy against the source and store its checksum')
+    watch = parsers['watch']
+    watch.add_argument('input', help='capture folder to watch')
+    watch.add_argument('output', help='folder to move the sorted pictures into')
+    watch.add_argument('--copy', action='store_true', help='copy instead of moving')
+    watch.add_argument('--verify', action='store_true',
+                       help='check each copy against the source and store its checksum')
+    watch.add_argument('--interval', type=float, default=10.0,
+                       help='seconds to collect new pictures before sorting them (default: 10)')
+    stack = parsers['stack']
+    stack.add_argument('--output', help='folder for masters of pictures that have not been moved')
+    stack.add_argument('--method', choices=('mean', 'median', 'sigma'), default='median',
+                       help='how frames are combined (sigma: sigma-clipped mean; default: median)')
+    stack.add_argument('--memory', type=int, default=1024,
+                       help='MB of frame data combined at a time across workers (default: 1024)')
+    opts = parser.parse_args(argv)
+    
+    # Keep a watching daemon light by default: one worker process
+    if opts.command == 'watch' and opts.workers is None:
+        opts.workers = 1
+    return opts
+
+def summarize(engine: Engine, opts: argparse.Namespace, seconds: float,
+              cancelled: bool) -> dict:
+    df = engine.pics_df
+    return {
+        'command': opts.command,
+        'catalog': os.path.abspath(opts.catalog),
+        'pictures': len(df),
+        'frame_types': {k: int(v) for k, v in df['FrameType'].value_counts().items()},
+        'moved': int(df['DestinationPath'].notna().sum()),
+        'duplicates': len(engine.duplicate_of()),
+        'seconds': round(seconds, 3),
+        'cancelled': cancelled,
+        'stages': engine.instruments.report(),
+        'concurrency': engine.instruments.concurrency_report(),
+        }
+
+def run(engine: Engine, opts: argparse.Namespace, token: CancelToken) -> bool:
+    if opts.command == 'analyze':
+        return engine.analyze_pics(location=os.path.abspath(opts.input), cancel_token=token,
+                                   classify=opts.classify, micro=opts.micro) is not None
+    elif opts.command == 'sort':
+        engine.sort_pics(cancel_token=token, micro=opts.micro)
+    elif opts.command == 'process':
+        os.makedirs(opts.output, exist_ok=True)
+        engine.stage_workers.update(ingest=opts.ingest_workers, transfer=opts.transfer_workers)
+        engine.process_pics(os.path.abspath(opts.input), os.path.abspath(opts.output), opts.copy,
+                            opts.verify, opts.micro, cancel_token=token)
+    elif opts.command == 'move':
+        os.makedirs(opts.output, exist_ok=True)
+        engine.move_pics(opts.copy, os.path.abspath(opts.output), cancel_token=token,
+                         verify=opts.verify)
+    elif opts.command == 'watch':
+        os.makedirs(opts.output, exist_ok=True)
+        save = lambda pics: engine.save_data(engine.pics_df, opts.catalog)
+        engine.watch_pics(os.path.abspath(opts.input), os.path.abspath(opts.output),
+                          opts.copy, opts.interval, cancel_token=token, batch_callback=save,
+                          verify=opts.verify)
+    elif opts.command == 'verify':
+        return not engine.verify_pics(cancel_token=token)
+    elif opts.command == 'stack':
+        output = os.path.abspath(opts.output) if opts.output else None
+        return engine.stack_pics(output, opts.method, cancel_token=token,
+                                 memory=opts.memory*1024**2) is not None
+    return True
+
+def main(argv: list = None) -> int:
+    opts = parse_args(argv)
+    stderr = lambda text: print(text, file=sys.stderr)
+    engine = Engine(notice=stderr if opts.json else print, alert=stderr, workers=opts.workers)
+    engine.readahead = opts.readahead
+    engine.physical_order = opts.physical_order
+    engine.adaptive = opts.adaptive
+    
+    # Ctrl+C stops the job cooperatively so the catalog is still saved consistently
+    token = CancelToken()
+    signal.signal(signal.SIGINT, lambda signum, frame: token.cancel())
+    
+    if os.path.exists(opts.catalog):
+        catalog = engine.load_data(opts.catalog)
+        if catalog is not None:
+            engine.pics_df = catalog
+    elif opts.command not in ('analyze', 'process', 'watch'):
+        stderr(f'No catalog found at {opts.catalog}: run "astrosorter analyze" first')
+        return 1
+    
+    t0 = time.time()
+    try:
+        with profile(opts.profile):
+            if not run(engine, opts, token):
+                return 1
+        engine.save_data(engine.pics_df, opts.catalog)
+    finally:
+        engine.process_pool.shutdown()
+    
+    if opts.stats:
+        stderr(engine.instruments.summary())
+    if opts.json:
+        print(json.dumps(summarize(engine, opts, time.time() - t0, token.cancelled), indent=2))
+    # Ctrl+C is the normal way to stop watching
+    return 130 if token.cancelled and opts.command != 'watch' else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
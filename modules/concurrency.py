@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Adaptive concurrency for the I/O-bound pools (metadata, previews, moves).
+# The right amount of work in flight depends on the storage: local NVMe keeps
+# getting faster with more outstanding reads, a USB card reader slows down
+# past two and a NAS sits in between. Like TCP congestion control, each
+# controller raises its limit by one after every window of completed work
+# while latency stays near the best it has seen (additive increase), and
+# halves it as soon as requests start queueing up behind each other
+# (multiplicative decrease). Throughput is tracked alongside for the report.
+
+import time
+import threading
+
+# Latency this many times the best seen counts as congestion
+CONGESTION = 1.5
+# The best latency is allowed to creep up by this factor per window, so one
+# fast window (e.g. from the page cache) doesn't pin the limit down for good
+DRIFT = 1.001
+# Completions per decision, at least (one window is `limit` completions)
+MIN_WINDOW = 8
+# Weight of the newest window in the throughput average
+SMOOTHING = 0.3
+
+class Controller(object):
+    def __init__(self, name: str, limit: int, maximum: int, minimum: int = 1,
+                 instruments=None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = max(minimum, min(limit, self.maximum))
+        self.instruments = instruments
+        self.best = None
+        self.throughput = None
+        self.increases = 0
+        self.decreases = 0
+        self.active = 0
+        self.t_changed = 0.0
+        self._cond = threading.Condition()
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        self.latencies = []
+        self.items = 0
+        self.t_window = None
+
+    def record(self, items: int, seconds: float) -> None:
+        # A unit of work (e.g. a chunk) finished, seconds after it was started
+        with self._cond:
+            now = time.perf_counter()
+            if now - seconds < self.t_changed:
+                # Started under the previous limit, so it says nothing about this one
+                return
+            if self.t_window is None:
+                self.t_window = now - seconds
+            self.latencies.append(seconds / max(1, items))
+            self.items += items
+            if len(self.latencies) >= max(self.limit, MIN_WINDOW):
+                self.adjust(self.items / max(now - self.t_window, 1e-9))
+                self._reset_window()
+
+    def adjust(self, throughput: float) -> None:
+        # The mean, not the median: with `limit` in flight it is limit/throughput,
+        # so it includes time spent queued behind the other requests
+        latency = sum(self.latencies) / len(self.latencies)
+        self.best = latency if self.best is None else min(latency, self.best * DRIFT)
+        congested = latency > self.best * CONGESTION
+        if congested and self.limit > self.minimum:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.decreases += 1
+            self.t_changed = time.perf_counter()
+        elif not congested and self.limit < self.maximum:
+            self.limit += 1
+            self.increases += 1
+            self.t_changed = time.perf_counter()
+        self.throughput = throughput if self.throughput is None else (
+            self.throughput + SMOOTHING*(throughput - self.throughput))
+        self._cond.notify_all()
+        if self.instruments is not None:
+            self.instruments.set_concurrency(self.name, self.report())
+
+    def acquire(self, stopped=None) -> bool:
+        # For threads sharing the limit; False if stopped() while waiting
+        with self._cond:
+            while self.active >= self.limit:
+                if stopped is not None and stopped():
+                    return False
+                self._cond.wait(0.05)
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def report(self) -> dict:
+        return {
+            'limit': self.limit,
+            'min': self.minimum,
+            'max': self.maximum,
+            'increases': self.increases,
+            'decreases': self.decreases,
+            'items_per_s': round(self.throughput or 0.0, 1),
+            }
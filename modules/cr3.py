@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# Canon CR3 files are ISO base media (ISO-BMFF) containers. Their metadata is
+# stored as TIFF structures in the CMT1 (IFD0) and CMT2 (EXIF) boxes of
+# Canon's uuid box inside moov (CMT3 holds maker notes, CMT4 GPS data), next
+# to a small THMB thumbnail; a larger PRVW preview sits in a top-level uuid
+# box of its own. Boxes are walked by seeking from header to header, so the
+# mdat payload (the raw sensor data, nearly all of the file) is never read.
+
+import struct
+
+BRAND = b'crx '
+CANON_UUID = bytes.fromhex('85c0b687820f11e08111f4ce462b6a48')
+PREVIEW_UUID = bytes.fromhex('eaf42b5e1c984b88b9fbb7dc406e4d16')
+
+# exifread tag name prefix for the TIFF structure in each metadata box
+TIFF_BOXES = {b'CMT1': 'Image', b'CMT2': 'EXIF'}
+# Offset of the JPEG length in THMB/PRVW payloads; the JPEG starts at 16
+JPEG_LENGTH = {b'THMB': 8, b'PRVW': 12}
+JPEG_START = 16
+
+def boxes(f, start: int, end: int):
+    # Yields (type, uuid or None, payload offset, end offset) for the boxes
+    # between start and end, reading only their headers
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        head = f.read(32)
+        if len(head) < 8:
+            return
+        size, kind = struct.unpack_from('>I4s', head)
+        header = 8
+        if size == 1:
+            if len(head) < 16:
+                return
+            size, = struct.unpack_from('>Q', head, 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        uuid = None
+        if kind == b'uuid':
+            uuid = head[header:header+16]
+            header += 16
+        if size < header or offset + size > end:
+            return
+        yield kind, uuid, offset + header, offset + size
+        offset += size
+
+def locate(f) -> dict:
+    # {box type: (payload offset, payload length)} of the metadata and
+    # preview boxes; empty if the file isn't a CR3
+    f.seek(0, 2)
+    size = f.tell()
+    found = {}
+    top = boxes(f, 0, size)
+    first = next(top, None)
+    if first is None or first[0] != b'ftyp':
+        return found
+    f.seek(first[2])
+    if f.read(4) != BRAND:
+        return found
+    for kind, uuid, start, end in top:
+        if kind == b'moov':
+            for kind, uuid, start, end in boxes(f, start, end):
+                if uuid == CANON_UUID:
+                    for kind, uuid, start, end in boxes(f, start, end):
+                        if kind in TIFF_BOXES or kind == b'THMB':
+                            found[kind] = (start, end - start)
+        elif uuid == PREVIEW_UUID:
+            # 8 bytes precede the PRVW box
+            for kind, uuid, start, end in boxes(f, start + 8, end):
+                if kind == b'PRVW':
+                    found[kind] = (start, end - start)
+    return found
+
+def preview_ranges(f, smallest: bool = False) -> list:
+    # The THMB (and PRVW) boxes, found by reading box headers from f
+    found = locate(f)
+    kinds = (b'THMB',) if smallest else (b'PRVW', b'THMB')
+    return [found[kind] for kind in kinds if kind in found]
+
+def tiff_blocks(f) -> dict:
+    # {exifread tag prefix: TIFF bytes} from the CMT boxes
+    blocks = {}
+    for kind, (start, length) in locate(f).items():
+        if kind in TIFF_BOXES:
+            f.seek(start)
+            blocks[TIFF_BOXES[kind]] = f.read(length)
+    return blocks
+
+def preview(buf, smallest: bool = False) -> bytes:
+    # The PRVW preview (1620x1080) or the THMB thumbnail (160x120), or None
+    found = locate(buf)
+    for kind in ((b'THMB', b'PRVW') if smallest else (b'PRVW', b'THMB')):
+        if kind not in found:
+            continue
+        start, length = found[kind]
+        if length < JPEG_START:
+            continue
+        size, = struct.unpack_from('>I', buf, start + JPEG_LENGTH[kind])
+        data = buf[start + JPEG_START:start + min(length, JPEG_START + size)]
+        if data[:2] == b'\xff\xd8':
+            return data
+    return None
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Finding the same picture stored at different paths (e.g. a session copied
+# into two folders). Files are compared in rounds that each read more of them:
+#   1. size: only files sharing their size with another file can be copies
+#   2. partial hash of the first and last 64 KB of each remaining file
+#   3. full hash, only for files whose partial hashes still collide
+# Hashing runs in the process pool. xxhash is used when it is installed,
+# otherwise blake2b from the standard library. Digests are cached by path,
+# size and mtime, so size groups whose files are all unchanged are not read
+# again when more pictures are added.
+
+import os
+import hashlib
+
+from .instrument import local
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+BLOCK = 64*1024
+READ_SIZE = 1024*1024
+
+# Positions of the digests in cache entries (see find_duplicates)
+PARTIAL, FULL = 2, 3
+
+def new_hash():
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+
+def partial_hash(filepath: str) -> str:
+    # Covers the whole file when it is no larger than two blocks
+    with local.timer('hashing') as sample, open(filepath, 'rb') as f:
+        h = new_hash()
+        head = f.read(BLOCK)
+        h.update(head)
+        size = os.fstat(f.fileno()).st_size
+        if size > 2*BLOCK:
+            f.seek(-BLOCK, os.SEEK_END)
+        tail = f.read(BLOCK)
+        h.update(tail)
+        sample.nbytes = len(head) + len(tail)
+    return h.hexdigest()
+
+def full_hash(filepath: str) -> str:
+    buf = bytearray(READ_SIZE)
+    view = memoryview(buf)
+    with local.timer('hashing') as sample, open(filepath, 'rb', buffering=0) as f:
+        h = new_hash()
+        while True:
+            count = f.readinto(buf)
+            if not count:
+                break
+            h.update(view[:count])
+            sample.nbytes += count
+    return h.hexdigest()
+
+def file_stats(paths: list) -> dict:
+    # {path: (size, mtime)}, without the files that can't be read
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+def size_groups(stats: dict) -> list:
+    sizes = {}
+    for path, (size, mtime) in stats.items():
+        sizes.setdefault(size, []).append(path)
+    return [(size, group) for size, group in sizes.items() if len(group) > 1]
+
+def hash_paths(groups: list, fn, field: int, cache: dict, process_pool, chunk_size: int,
+               cancel_token=None) -> dict:
+    # {path: digest} for every file in the groups; digests already in the
+    # cache are reused and new ones are added to it
+    paths = [path for size, group in groups for path in group]
+    missing = [path for path in paths if cache[path][field] is None]
+    for chunk, results in process_pool.map_chunks(fn, missing, chunk_size, cancel_token):
+        for path, digest in zip(chunk, results):
+            if not isinstance(digest, Exception):
+                entry = list(cache[path])
+                entry[field] = digest
+                cache[path] = tuple(entry)
+    return {path: cache[path][field] for path in paths if cache[path][field] is not None}
+
+def split_groups(groups: list, digests: dict) -> list:
+    # Split each group of candidates by their digests; groups keep the size
+    # they were bucketed by and the order files were given in, so the first
+    # one stays the original
+    buckets = {}
+    for size, group in groups:
+        for path in group:
+            if path in digests:
+                buckets.setdefault((size, digests[path]), []).append(path)
+    return [(size, group) for (size, digest), group in buckets.items() if len(group) > 1]
+
+def unique_paths(paths: list) -> list:
+    # The same file given twice (or through a symlink) is not a copy of itself
+    seen, unique = set(), []
+    for path in paths:
+        real = os.path.realpath(path)
+        if real not in seen:
+            seen.add(real)
+            unique.append(path)
+    return unique
+
+def find_duplicates(paths: list, process_pool, cancel_token=None, cache: dict = None) -> dict:
+    # Returns {duplicate path: original path}; the first of each set of
+    # identical files (in the order given) is the original. cache maps each
+    # path to (size, mtime, partial hash, full hash) from earlier calls and is
+    # updated in place, so only files that are new or changed since then
+    # are read again
+    cache = {} if cache is None else cache
+    stats = file_stats(unique_paths(paths))
+    for path, stat in stats.items():
+        if cache.get(path, (None, None))[:2] != stat:
+            cache[path] = (*stat, None, None)
+    groups = size_groups(stats)
+    groups = split_groups(groups, hash_paths(groups, partial_hash, PARTIAL, cache, process_pool,
+                                             25, cancel_token))
+    small = [(size, group) for size, group in groups if size <= 2*BLOCK]
+    large = [(size, group) for size, group in groups if size > 2*BLOCK]
+    groups = small + split_groups(large, hash_paths(large, full_hash, FULL, cache, process_pool,
+                                                    1, cancel_token))
+    duplicates = {}
+    for size, group in groups:
+        for path in group[1:]:
+            if path != group[0]:
+                duplicates[path] = group[0]
+    return duplicates
@@ -0,0 +1,773 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+# The picture pipeline (find, analyze, sort, move) without any Qt, shared by
+# the GUI and the headless command line (see cli.py)
+
+import os
+import pickle
+import time
+import itertools
+from datetime import datetime, date
+from fractions import Fraction
+from functools import partial
+from threading import Event
+
+from . import (concurrency, duplicates, formats, instrument, integrity, layout, pipeline, pool,
+               prefetch, stacking, tasks, watch)
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+rawpy = lazy_import('rawpy')
+
+class CancelToken(object):
+    # Jobs check the token between files and stop early once it is set
+    def __init__(self):
+        self._event = Event()
+        
+    def cancel(self) -> None:
+        self._event.set()
+        
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+class Engine(object):
+    def __init__(self, notice=None, alert=None, workers: int = None):
+        # Status messages go to print unless the caller routes them elsewhere
+        self.notice = notice if notice is not None else print
+        self.alert = alert if alert is not None else print
+        
+        # Per-stage timings of every job (see instrument.py)
+        self.instruments = instrument.Instruments()
+        
+        # CPU-bound work (EXIF parsing, thumbnail decoding) runs in a process
+        # pool shared by every job for the whole session
+        self.process_pool = pool.ProcessPool(workers, self.instruments)
+        
+        # Photo variables
+        self.pic_exts = formats.extensions()
+        self.metadata_fields = {
+            'Filename': str,
+            'Image DateTime': str,
+            'FrameType': str,
+            'ImageGroup': str,
+            'EXIF ExposureTime': str,
+            'EXIF ISOSpeedRatings': int,
+            'EXIF FNumber': str,
+            'EXIF FocalLength': int,
+            'Image ImageWidth': int,
+            'Image ImageLength': int,
+            'EXIF ColorSpace': str,
+            'Image Make': str,
+            'Image Model': str,
+            'EXIF LensModel': str,
+            'EXIF ExposureProgram': str,
+            'EXIF SensitivityType': str,
+            'EXIF Flash': str,
+            'EXIF LensSpecification': object,
+            'DarkFraction': float,
+            'DestinationFolder': str,
+            'DestinationPath': str,
+            'DuplicateOf': str,
+            'Checksum': str,
+            }
+        
+        # Catalog columns caching each picture's duplicate-detection digests,
+        # valid while its size and mtime are unchanged (see duplicates.py)
+        self.digest_columns = ('FileSize', 'FileModified', 'PartialHash', 'FullHash')
+        
+        # Partial results are streamed to the GUI every batch_size files or
+        # batch_interval seconds, whichever comes first
+        self.batch_size = 100
+        self.batch_interval = 0.5
+        
+        # Number of files handed to a worker process at a time
+        self.chunk_size = 25
+        
+        # Chunks in flight per pipeline stage; None lets an adaptive controller
+        # find the number that suits the storage (see concurrency.py), or
+        # gives two per worker process when adaptive is off
+        self.stage_workers = {'ingest': None, 'transfer': None}
+        self.adaptive = True
+        self.controllers = {}
+        
+        # Workers read ahead of the files they parse (see prefetch.py)
+        self.readahead = True
+        
+        # Process files in their order on disk rather than catalog order, for
+        # archives on spinning disks (see layout.py)
+        self.physical_order = False
+        
+        self.reset_info()
+
+    # =============================================================================
+    # FINDING, LOADING, AND ANALYZING PHOTOS
+    # =============================================================================
+    def is_pic(self, filepath: str) -> bool:
+        return os.path.splitext(filepath)[1].lower().lstrip('.') in self.pic_exts
+        
+    def get_pics(self, location: str) -> list:
+        if type(location) is not str:
+            return self.alert(f'Expected location as a string, got {type(location)}')
+        if not os.path.exists(location):
+            return self.alert(f'{location} does not exist!')
+        with self.instruments.timer('discovery'):
+            return list(self.iter_pics(location))
+    
+    def iter_pics(self, location: str):
+        for root, dirs, files in os.walk(location):
+            yield from (os.path.join(root, f) for f in files if self.is_pic(f))
+        
+    def analyze_pics(self, pics: list = None, location: str = None,
+                     cancel_token=None, partial_callback=None, classify: bool = False,
+                     micro: bool = False, *args, **kwargs) -> pd.DataFrame:
+        # classify: also measure each picture's dark fraction while it is
+        # mapped for its metadata, so sorting needs no second read
+        # (micro: from the smallest embedded image, see formats.MICRO_SIZE)
+        
+        if pics is None and location is None:
+            return self.alert('Unable to analyze pictures: requires list of images or a location')
+        
+        t0 = time.time()
+        
+        # Get list of picture filepaths
+        pics = pics if pics else self.get_pics(location)
+        if pics is None:
+            return self.alert('Found no pictures to analyze...')
+        
+        # Pictures the catalog already has at their destination (e.g. when the
+        # output folder is inside the input folder) are not catalogued again
+        moved = self.moved_paths()
+        pics = [path for path in pics if not moved or os.path.realpath(path) not in moved]
+        
+        self.notice(f'Analyzing {len(pics)} pictures...')
+        
+        # Read metadata in batches, streaming each one to the GUI as it is ready;
+        # if the job is cancelled, the pictures analyzed so far are still kept
+        read = partial(tasks.ingest, fields=tuple(self.metadata_fields), classify=classify,
+                       micro=micro)
+        chunks = self.process_pool.map_chunks(read, self.io_order(pics), self.chunk_size,
+                                              cancel_token,
+                                              prefetcher=self.prefetcher(classify, micro),
+                                              in_flight=self.stage_workers['ingest'],
+                                              controller=self.controller('metadata', 'ingest'))
+        frames = self.collect_metadata(chunks, partial_callback)
+        if self.is_cancelled(cancel_token):
+            self.notice(f'Cancelled after analyzing {sum(map(len, frames))}/{len(pics)} pictures')
+        if not frames:
+            return self.pics_df
+        self.merge_metadata(frames, pics, cancel_token)
+        self.notice(f'Analyzed {sum(map(len, frames))} pictures in {time.time()-t0:.2f} seconds')
+        return self.pics_df
+    
+    def process_pics(self, location: str, folder: str, copy: bool = False, verify: bool = False,
+                     micro: bool = False, cancel_token=None, partial_callback=None,
+                     *args, **kwargs) -> None:
+        # Analyze, sort and move in one pass. Discovery, readahead, parsing and
+        # classifying (one mapping per file, see tasks.ingest) and cataloguing
+        # run as concurrent stages (see pipeline.py), so the folder walk, the
+        # disk, the workers and the catalog are busy at the same time. Sorting
+        # needs every frame's settings (bias frames are the shortest exposure,
+        # a setting seen once is Misc), so no frame's label is final before
+        # the walk ends; moves then stream through the pool group by group
+        t0 = time.time()
+        if not os.path.exists(location):
+            return self.alert(f'{location} does not exist!')
+        self.notice(f'Processing pictures in {location}...')
+        
+        discovered, moved = [], self.moved_paths()
+        def discover():
+            # Only the folder walk counts as discovery, not the time spent
+            # waiting for the ingest stage to take the next chunk
+            pics = (path for path in self.iter_pics(location)
+                    if not moved or os.path.realpath(path) not in moved)
+            walking = 0.0
+            try:
+                while True:
+                    t0 = time.perf_counter()
+                    chunk = list(itertools.islice(pics, self.chunk_size))
+                    walking += time.perf_counter() - t0
+                    if not chunk:
+                        return
+                    discovered.extend(chunk)
+                    yield chunk
+            finally:
+                self.instruments.add('discovery', walking)
+        # The read stage asks the OS for the ranges parsing will touch (see
+        # prefetch.py) while earlier chunks are parsed; with one chunk queued
+        # per parse thread, that is as far ahead as it gets
+        ingest = partial(tasks.ingest, fields=tuple(self.metadata_fields), classify=True,
+                         micro=micro)
+        parse = lambda chunk: [(chunk, self.process_pool.run(ingest, chunk))]
+        workers = self.stage_workers['ingest'] or 2*max(1, self.process_pool.max_workers)
+        stages = [pipeline.Stage('parse', parse, workers, capacity=workers,
+                                 controller=self.controller('metadata', 'ingest'), count=len)]
+        if self.readahead:
+            stages.insert(0, pipeline.Stage('read', partial(self.read_ahead, micro=micro), 2))
+        chunks = pipeline.Pipeline(stages, cancel_token).run(discover())
+        frames = self.collect_metadata(chunks, partial_callback)
+        if frames:
+            self.merge_metadata(frames, discovered, cancel_token)
+        if self.is_cancelled(cancel_token):
+            return self.notice(f'Cancelled after analyzing {sum(map(len, frames))} pictures')
+        if not frames:
+            return self.alert(f'Found no pictures in {location}')
+        self.notice(f'Analyzed {sum(map(len, frames))} pictures in {time.time()-t0:.2f} seconds')
+        
+        self.sort_pics(True, cancel_token, partial_callback, micro=micro)
+        if not self.is_cancelled(cancel_token):
+            self.move_pics(copy, folder, cancel_token, verify=verify)
+        self.notice(f'Processed {len(self.pics_df)} pictures in {time.time()-t0:.2f} seconds')
+    
+    def read_ahead(self, chunk: list, micro: bool = False) -> list:
+        # Pipeline stage in front of parsing (see process_pics)
+        with self.instruments.timer('readahead'):
+            for path in chunk:
+                try:
+                    prefetch.hint(path, True, micro)
+                except Exception:
+                    # The file is reported when it's parsed
+                    continue
+        return [chunk]
+    
+    def collect_metadata(self, chunks, partial_callback=None) -> list:
+        # Catalog frames from (chunk, tasks.ingest results) pairs, sent to the
+        # GUI every batch_size pictures or batch_interval seconds
+        frames, batch = [], {}
+        t_batch = time.time()
+        # Fields that failed to convert are reported once per job
+        failed = set()
+        for chunk, results in chunks:
+            for path, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    self.alert(f'Unable to get image metadata from {path} ({result})')
+                    result = {}, None
+                metadata, dark_fraction = result
+                if dark_fraction is not None:
+                    metadata['DarkFraction'] = dark_fraction
+                batch[path] = metadata
+            if len(batch) >= self.batch_size or time.time() - t_batch > self.batch_interval:
+                frames.append(self.metadata_frame(batch, failed))
+                self.send_partial(partial_callback, frames[-1])
+                batch, t_batch = {}, time.time()
+        if batch:
+            frames.append(self.metadata_frame(batch, failed))
+            self.send_partial(partial_callback, frames[-1])
+        return frames
+    
+    def merge_metadata(self, frames: list, pics: list, cancel_token=None) -> None:
+        # Pictures finish out of order (disk order, pipeline stages), so the
+        # catalog is put back in discovery order
+        df = pd.concat(frames)
+        df = df.loc[pd.Index(pics).intersection(df.index, sort=False)]
+        
+        # Remove duplicate entries in case the same files are analyzed multiple times
+        df = df if self.pics_df is None else pd.concat([self.pics_df, df])
+        df = df[~df.index.duplicated(keep='first')]
+        
+        # Replace 'nan' with 'None' so it looks cleaner in the table view
+        self.pics_df = df.replace({np.nan: None, 'nan': None})
+        
+        # The same picture stored under another path is only sorted and moved once
+        if not self.is_cancelled(cancel_token):
+            self.find_duplicates(cancel_token)
+    
+    def metadata_frame(self, pic_dict: dict, failed: set = None) -> pd.DataFrame:
+        # Store metadata in a dataframe with the filepath as index; fields in
+        # failed (shared by the batches of a job) are not reported again
+        failed = set() if failed is None else failed
+        columns = [field.split(' ')[-1] for field in self.metadata_fields]
+        df = pd.DataFrame.from_dict(pic_dict, orient='index')
+        df.rename(columns=lambda c: c.split(' ')[-1], inplace=True)
+        df = df.reindex(columns=columns)
+        df.index.rename('Filepath', inplace=True)
+        
+        # Make sure the columns are the proper datatypes
+        with self.instruments.timer('dtype_coercion'):
+            df['Filename'] = [os.path.basename(filepath) for filepath in df.index]
+            for field, func in self.metadata_fields.items():
+                try:
+                    col = field.split(' ')[-1]
+                    df[col] = df[col].astype(func)
+                except:
+                    if field not in failed:
+                        self.alert(f'Could not convert {field} using {func}')
+                        failed.add(field)
+            df['DateTime'] = df['DateTime'].apply(self.reformat_date)
+            df['FNumber'] = df['FNumber'].apply(self.to_fraction)
+            return df.replace({np.nan: None, 'nan': None})
+    
+    def find_duplicates(self, cancel_token=None) -> int:
+        # Compares every picture in the catalog where it is now (moved pictures
+        # at their destination) and fills in DuplicateOf with the original
+        # Rows for the sorted copy of another row (catalogs from before
+        # analyze skipped them) are the same file, not a duplicate
+        df = self.pics_df
+        destinations = {os.path.realpath(dest): path
+                        for path, dest in zip(df.index, df['DestinationPath']) if dest is not None}
+        df = df[[destinations.get(os.path.realpath(path), path) == path for path in df.index]]
+        locations = self.locations(df)
+        filepaths = dict(zip(locations, df.index))
+        # Digests from earlier batches are kept in the catalog, so only
+        # pictures that are new or changed since then are hashed
+        cache = {}
+        if all(column in df for column in self.digest_columns):
+            rows = zip(locations, *(df[column] for column in self.digest_columns))
+            cache = {location: tuple(entry) for location, *entry in rows if entry[0] is not None}
+        found = duplicates.find_duplicates(list(locations), self.process_pool, cancel_token, cache)
+        entries = dict(zip(df.index, map(cache.get, locations)))
+        for i, column in enumerate(self.digest_columns):
+            values = [entry[i] if entry else None for entry in map(entries.get, self.pics_df.index)]
+            self.pics_df[column] = pd.Series(values, index=self.pics_df.index, dtype=object)
+        if self.is_cancelled(cancel_token):
+            return 0
+        duplicate_of = pd.Series(None, index=self.pics_df.index, dtype=object)
+        for location, original in found.items():
+            if filepaths[location] != filepaths[original]:
+                duplicate_of[filepaths[location]] = filepaths[original]
+        self.pics_df['DuplicateOf'] = duplicate_of
+        if found:
+            self.notice(f'Found {len(found)} duplicate pictures')
+        return len(found)
+        
+    def get_metadata(self, filepath: str) -> dict:
+        metadata = {}
+        try:
+            if self.is_pic(filepath):
+                metadata = tasks.read_metadata(filepath, tuple(self.metadata_fields))
+                self.instruments.merge(instrument.local.drain())
+                return metadata
+            else:
+                self.alert(f'{filepath} is not a valid picture file: skipping...')
+            return metadata
+        except Exception as ex:
+            self.alert(f'Unable to get image metadata from {filepath} ({ex})')
+            return metadata
+        
+    def load_image(self, filepath: str):
+        return tasks.load_image(filepath)
+    
+    def load_thumbnail(self, filepath: str) -> np.ndarray:
+        try:
+            return tasks.load_thumbnail(filepath)
+        except rawpy.LibRawNoThumbnailError:
+            return self.alert(f'No thumbnail found for {filepath}')
+        except rawpy.LibRawUnsupportedThumbnailError:
+            return self.alert(f'Unsupported thumbnail from {filepath}')
+        
+    def get_pct_dark(self, filepath: str, threshold: int = 50, micro: bool = False) -> float:
+        try:
+            return tasks.pct_dark(filepath, threshold, micro)
+        except Exception as ex:
+            return self.alert(f'Could not load {filepath} ({ex})')
+        finally:
+            self.instruments.merge(instrument.local.drain())
+        
+    # =============================================================================
+    # SORTING AND MOVING PHOTOS   
+    # =============================================================================
+    def sort_pics(self, autodetect: bool = True, cancel_token=None,
+                  partial_callback=None, micro: bool = False, *args, **kwargs) -> pd.DataFrame:
+        # micro: tell dark from light frames by their smallest embedded image
+        t0 = time.time()
+        num_pics = len(self.pics_df)
+        self.notice(f'Sorting {num_pics} pictures...')
+        
+        # Work on a copy so a cancelled sort leaves self.pics_df untouched;
+        # duplicates are left out and take the labels of their originals
+        duplicate_of = self.duplicate_of()
+        pics_df = self.pics_df.drop(duplicate_of.index)
+        
+        # Get list of unique conditions
+        t_grouping = time.perf_counter()
+        settings = ['ExposureTime', 'ExposureTimeFloat', 'ISOSpeedRatings', 'FNumber']
+        df = pics_df.copy()
+        df = df[~df.index.duplicated()]
+        df['ExposureTimeFloat'] = df['ExposureTime'].apply(self.to_fraction)
+        
+        # Sort out bias frames (min. exposure time) and other frames (unique settings)
+        conditions = df.groupby(settings).size().reset_index().rename(columns={0: 'Count'})
+        conditions['FrameType'] = None
+        min_exp = df['ExposureTime'].apply(self.to_fraction).min()
+        for i, group in conditions.iterrows():
+            mask = ((df['ExposureTime'] == group['ExposureTime']) &
+                    (df['ISOSpeedRatings'] == group['ISOSpeedRatings']) &
+                    (df['FNumber'] == group['FNumber']))
+            iso, fnum = group['ISOSpeedRatings'], group['FNumber']
+            group_name = f'{iso:.0f} ISO f{fnum:.1f}'
+            pics_df.loc[mask, 'ImageGroup'] = group_name
+            if group['ExposureTimeFloat'] == min_exp:
+                conditions.loc[i, 'FrameType'] = 'Bias'
+                pics_df.loc[mask, 'FrameType'] = 'Bias'
+            elif group['Count'] == 1:
+                conditions.loc[i, 'FrameType'] = 'Misc'
+                pics_df.loc[mask, 'FrameType'] = 'Misc'
+            else:
+                conditions.loc[i, 'FrameType'] = 'Unsorted'
+                pics_df.loc[mask, 'FrameType'] = 'Unsorted'
+                
+        # Sort out dark/light and flat frames
+        settings = ['ISOSpeedRatings', 'FNumber']
+        isos = conditions[conditions['FrameType'] != 'Misc']
+        isos = isos.groupby(settings).size().reset_index().rename(columns={0: 'Groups'})
+        for i, group in isos.iterrows():
+            mask = ((df['ISOSpeedRatings'] == group['ISOSpeedRatings']) &
+                    (df['FNumber'] == group['FNumber']) &
+                    (pics_df['FrameType'] == 'Unsorted'))
+            if group['Groups'] == 3:
+                iso, fnum = group['ISOSpeedRatings'], group['FNumber']
+                group_name = f'{iso:.0f} ISO f{fnum:.1f}'
+                pics_df.loc[mask, 'ImageGroup'] = group_name
+                times = sorted(df.loc[mask, 'ExposureTimeFloat'].tolist())
+                t_min, t_max = float(times[0]), float(times[-1])
+                flat_mask = mask & (pics_df['ExposureTime'].apply(self.to_fraction) == t_min)
+                other_mask = mask & (pics_df['ExposureTime'].apply(self.to_fraction) == t_max)
+                pics_df.loc[flat_mask, 'FrameType'] = 'Flat'
+                pics_df.loc[other_mask, 'FrameType'] = 'Dark or Light'
+            else:
+                pics_df.loc[mask, 'FrameType'] = 'Misc'
+                iso, fnum = group['ISOSpeedRatings'], group['FNumber']
+                group_name = f'{iso:.0f} ISO f{fnum:.1f}'
+                pics_df.loc[mask, 'ImageGroup'] = group_name
+        self.instruments.add('grouping', time.perf_counter() - t_grouping)
+                
+        # Distinguish dark and light frames in the process pool, streaming labels
+        # to the GUI in batches
+        # (frames with a DarkFraction from analyzing or an earlier sort reuse it)
+        if 'DarkFraction' not in pics_df:
+            pics_df['DarkFraction'] = None
+        unknown = pics_df['FrameType'] == 'Dark or Light'
+        known = unknown & pics_df['DarkFraction'].notna()
+        pics_df.loc[known, 'FrameType'] = pics_df.loc[known, 'DarkFraction'].map(self.dark_or_light)
+        self.send_partial(partial_callback, pics_df)
+        # (read from where each frame is now, as earlier passes may have moved it)
+        unknown = pics_df[unknown & ~known]
+        filepaths = dict(zip(self.locations(unknown), unknown.index))
+        classify = partial(tasks.pct_dark, threshold=50, micro=micro)
+        batch, t_batch = [], time.time()
+        for chunk, results in self.process_pool.map_chunks(classify, self.io_order(list(filepaths)),
+                                                           self.chunk_size, cancel_token,
+                                                           prefetcher=self.prefetcher(True, micro),
+                                                           controller=self.controller('preview')):
+            for location, pct_dark in zip(chunk, results):
+                i = filepaths[location]
+                if isinstance(pct_dark, Exception):
+                    self.alert(f'Could not load {location} ({pct_dark})')
+                    continue
+                pics_df.loc[i, 'DarkFraction'] = pct_dark
+                pics_df.loc[i, 'FrameType'] = self.dark_or_light(pct_dark)
+                batch.append(i)
+            if len(batch) >= self.batch_size or time.time() - t_batch > self.batch_interval:
+                self.send_partial(partial_callback, pics_df.loc[batch])
+                batch, t_batch = [], time.time()
+        if batch:
+            self.send_partial(partial_callback, pics_df.loc[batch])
+        if self.is_cancelled(cancel_token):
+            self.notice('Cancelled sorting pictures')
+            return self.pics_df
+                
+        # Catch anything else that might have been missed
+        pics_df.loc[pics_df['FrameType'].isna(), 'FrameType'] = 'Unknown'
+        if len(duplicate_of):
+            labels = ['FrameType', 'ImageGroup']
+            copies = self.pics_df.loc[duplicate_of.index].copy()
+            # An original that is no longer in the catalog leaves the labels empty
+            originals = pics_df.reindex(duplicate_of.to_numpy())[labels]
+            copies[labels] = originals.replace({np.nan: None}).to_numpy()
+            pics_df = pd.concat([pics_df, copies]).loc[self.pics_df.index]
+            self.send_partial(partial_callback, copies)
+        self.pics_df = pics_df
+                
+        self.notice(f'Sorted {num_pics} pictures in {time.time()-t0:.2f} seconds')
+        
+        return self.pics_df
+    
+    def move_pics(self, copy: bool = False, folder: str = None, cancel_token=None,
+                  verify: bool = False, *args, **kwargs) -> None:
+        # verify: copies are hashed while copying and read back from disk,
+        # and the checksum is stored in the catalog (see integrity.py)
+        t0 = time.time()
+        num_pics = len(self.pics_df)
+        num_left = num_pics
+        self.notice(f'Moving {num_pics} pictures...')
+        if folder is None:
+            return self.alert('Unable to move pictures: requires an output folder')
+            
+        # Duplicates stay where they are, and so do frames that couldn't be
+        # told apart as dark or light (a later sort can still classify them)
+        skipped = set(self.duplicate_of().index)
+        unclassified = self.pics_df['FrameType'] == 'Dark or Light'
+        unclassified = set(self.pics_df.index[unclassified]) - skipped
+        num_left -= len(skipped) + len(unclassified)
+        
+        # Each set of ISO shots with at least 2 shutter speeds is an image group.
+        # Groups are planned one at a time as the pool takes more transfers,
+        # so the first group's files are moving while later ones are planned
+        plan, sources = {}, {}
+        def transfers():
+            nonlocal num_left
+            for group in self.pics_df['ImageGroup'].unique():
+                frames = self.pics_df[self.pics_df['ImageGroup'] == group]
+                for frame in frames['FrameType'].unique():
+                    if frame == 'Dark or Light':
+                        continue
+                    # Create subfolders
+                    mask = ((self.pics_df['FrameType'] == frame) & 
+                            (self.pics_df['ImageGroup'] == group))
+                    if frame != 'Misc':
+                        subfolder = os.path.join(folder, group, frame).replace('\\', '/')
+                    else:
+                        subfolder = os.path.join(folder, frame).replace('\\', '/')
+                    if not os.path.exists(subfolder):
+                        os.makedirs(subfolder)
+                    for filepath, info in self.pics_df[mask].iterrows():
+                        if filepath in skipped:
+                            continue
+                        dest_path = os.path.join(subfolder, info['Filename']).replace('\\', '/')
+                        plan[filepath] = (subfolder, dest_path)
+                        # Pictures that were already moved by an earlier pass are
+                        # relocated from where they are now (only renamed, even
+                        # in copy mode) or left in place
+                        current = info['DestinationPath']
+                        if current is not None and os.path.exists(current):
+                            if current != dest_path:
+                                sources[current] = filepath
+                                yield current, dest_path, False, False
+                            else:
+                                num_left -= 1
+                        else:
+                            sources[filepath] = filepath
+                            yield filepath, dest_path, copy, verify
+                    
+        # Move files in the process pool, recording destinations only once each
+        # file is in place (running chunks are finished even when cancelled).
+        # Disk order needs every transfer, so it plans all groups first
+        items = transfers()
+        if self.physical_order:
+            items = self.io_order(list(items), key=lambda transfer: transfer[0])
+        for chunk, results in self.process_pool.map_chunks(tasks.transfer_file, items, 4,
+                                                           cancel_token, drain=True,
+                                                           in_flight=self.stage_workers['transfer'],
+                                                           controller=self.controller('transfer',
+                                                                                      'transfer')):
+            for (src, dest_path, *_), result in zip(chunk, results):
+                filepath = sources[src]
+                if isinstance(result, Exception):
+                    self.alert(f'Unable to move {filepath} ({result})')
+                    continue
+                self.pics_df.loc[filepath, 'DestinationFolder'] = plan[filepath][0]
+                self.pics_df.loc[filepath, 'DestinationPath'] = dest_path
+                if result is not None:
+                    self.pics_df.loc[filepath, 'Checksum'] = result
+                num_left -= 1
+            self.notice(f'Moving pictures: {num_left}/{num_pics} remaining')
+        if self.is_cancelled(cancel_token):
+            return self.notice(f'Cancelled moving pictures: {num_left}/{num_pics} not moved')
+                    
+        if skipped:
+            self.notice(f'Skipped {len(skipped)} duplicate pictures')
+        if unclassified:
+            self.alert(f'Left {len(unclassified)} pictures that could not be classified in place')
+        self.notice(f'Moved {num_pics - len(skipped) - len(unclassified)} pictures '
+                    f'in {time.time()-t0:.2f} seconds')
+    
+    def verify_pics(self, cancel_token=None, *args, **kwargs) -> list:
+        # Re-hash copies that have a checksum; returns the ones that changed
+        # or went missing
+        if 'Checksum' not in self.pics_df:
+            return []
+        df = self.pics_df[self.pics_df['Checksum'].notna() & self.pics_df['DestinationPath'].notna()]
+        self.notice(f'Verifying {len(df)} copied pictures...')
+        entries = list(zip(df['DestinationPath'], df['Checksum']))
+        bad = []
+        for chunk, results in self.process_pool.map_chunks(integrity.verify_file, entries, 4,
+                                                           cancel_token):
+            for (path, checksum), result in zip(chunk, results):
+                if result is not True:
+                    reason = 'checksum mismatch' if result is False else result
+                    self.alert(f'{path} failed verification ({reason})')
+                    bad.append(path)
+        if self.is_cancelled(cancel_token):
+            self.notice('Cancelled verifying pictures')
+        else:
+            self.notice(f'Verified {len(df) - len(bad)}/{len(df)} copied pictures')
+        return bad
+    
+    # =============================================================================
+    # BUILDING MASTER CALIBRATION FRAMES
+    # =============================================================================
+    def stack_pics(self, folder: str = None, method: str = 'median', cancel_token=None,
+                   memory: int = 1024*1024**2, *args, **kwargs) -> dict:
+        # One master per image group and calibration frame type, written next
+        # to the sorted frames (e.g. <folder>/800 ISO f5.6/Master Dark.fits).
+        # Pictures that haven't been moved need an output folder
+        if method not in stacking.METHODS:
+            return self.alert(f'Unknown stacking method {method}: use one of {stacking.METHODS}')
+        t0 = time.time()
+        df = self.pics_df.drop(self.duplicate_of().index)
+        df = df[df['FrameType'].isin(['Bias', 'Dark', 'Flat']) & df['ImageGroup'].notna()]
+        masters = {}
+        for (group, frame), frames in df.groupby(['ImageGroup', 'FrameType']):
+            paths = [path for path in self.locations(frames) if os.path.exists(path)]
+            moved = frames['DestinationFolder'].dropna()
+            if len(moved):
+                master_folder = os.path.dirname(moved.iloc[0])
+            elif folder is not None:
+                master_folder = os.path.join(folder, group).replace('\\', '/')
+            else:
+                self.alert(f'Not stacking {group} {frame}: requires an output folder')
+                continue
+            if len(paths) < 2:
+                self.notice(f'Not stacking {group} {frame}: needs at least 2 frames')
+                continue
+            os.makedirs(master_folder, exist_ok=True)
+            master_path = os.path.join(master_folder, f'Master {frame}.fits').replace('\\', '/')
+            self.notice(f'Stacking {len(paths)} {frame} frames of {group} ({method})...')
+            info = frames.iloc[0]
+            cards = [('IMAGETYP', f'Master {frame}'), ('IMAGEGRP', group),
+                     ('EXPTIME', self.to_fraction(info['ExposureTime'])),
+                     ('ISOSPEED', info['ISOSpeedRatings']), ('INSTRUME', info['Model'])]
+            cards = [(key, value) for key, value in cards if value is not None]
+            try:
+                count = stacking.stack_frames(paths, master_path, method, self.process_pool,
+                                              cancel_token, memory, cards, self.alert)
+            except Exception as ex:
+                self.alert(f'Unable to stack {group} {frame} ({ex})')
+                continue
+            if self.is_cancelled(cancel_token):
+                self.notice('Cancelled stacking pictures')
+                break
+            if count:
+                masters[f'{group}/{frame}'] = master_path
+        self.notice(f'Built {len(masters)} master frames in {time.time()-t0:.2f} seconds')
+        return masters
+    
+    # =============================================================================
+    # WATCHING A CAPTURE FOLDER
+    # =============================================================================
+    def watch_pics(self, location: str, folder: str, copy: bool = False,
+                   interval: float = 10.0, cancel_token=None, batch_callback=None,
+                   verify: bool = False, *args, **kwargs) -> None:
+        # Analyze, sort and move pictures as they are captured. New files are
+        # collected for `interval` seconds and then run through the normal
+        # pipeline; frames whose type changes as more arrive (e.g. a lone
+        # 'Misc' frame that becomes part of a group) are relocated
+        watcher = watch.open_watcher(location, self.is_pic, exclude=folder, alert=self.alert)
+        self.notice(f'Watching {location} for new pictures...')
+        pending, t_batch = set(), time.time()
+        try:
+            while not self.is_cancelled(cancel_token):
+                pending.update(watcher.poll(timeout=min(1.0, interval)))
+                if not pending or time.time() - t_batch < interval:
+                    continue
+                known = set(self.pics_df.index) | set(self.pics_df['DestinationPath'].dropna())
+                pics = sorted(path for path in pending if path not in known)
+                pending, t_batch = set(), time.time()
+                if not pics:
+                    continue
+                self.analyze_pics(pics=pics, cancel_token=cancel_token)
+                self.sort_pics(cancel_token=cancel_token)
+                self.move_pics(copy, folder, cancel_token, verify)
+                if batch_callback is not None:
+                    batch_callback(pics)
+        finally:
+            watcher.close()
+        self.notice(f'Stopped watching {location}')
+    
+    # =============================================================================
+    # SAVING AND LOADING DATA
+    # =============================================================================
+    def save_data(self, data, save_path: str) -> None:
+        with open(save_path, 'wb') as f:
+            pickle.dump(data, f)
+        self.notice(f'Saved data to {save_path}')
+        
+    def load_data(self, filepath: str):
+        if not os.path.exists(filepath):
+            self.alert(f'Unable to load data: {filepath} not found')
+            return None
+        try:
+            with open(filepath, 'rb') as f:
+                info = pickle.load(f)
+            self.notice(f'Successfully loaded info from {filepath}')
+            return info
+        except Exception as ex:
+            self.alert(f'Unable to load info from {filepath}\n\t(Error {ex})')
+    
+    # =============================================================================
+    # HELPER FUNCTIONS
+    # =============================================================================
+    def reset_info(self) -> None:
+        # The empty catalog is only built when it is first used, so creating
+        # an Engine doesn't import pandas before the window paints
+        self._pics_df = None
+    
+    @property
+    def pics_df(self) -> pd.DataFrame:
+        if self._pics_df is None:
+            columns = [name.split(' ')[-1] for name in self.metadata_fields.keys()]
+            self._pics_df = pd.DataFrame(columns = columns)
+        return self._pics_df
+    
+    @pics_df.setter
+    def pics_df(self, df: pd.DataFrame) -> None:
+        self._pics_df = df
+        
+    def reformat_date(self, date_string: str) -> str:
+        time_obj = datetime.strptime(date_string, '%Y:%m:%d %H:%M:%S')
+        return date.strftime(time_obj, '%m/%d/%Y %H:%M:%S')
+    
+    def to_fraction(self, fraction: str) -> float:
+        try: return float(Fraction(fraction))
+        except: return fraction
+    
+    def dark_or_light(self, pct_dark: float) -> str:
+        return 'Dark' if pct_dark > 0.99 else 'Light'
+    
+    def duplicate_of(self) -> pd.Series:
+        # Original filepath of each duplicate picture (catalogs saved before
+        # duplicate detection have no DuplicateOf column)
+        if 'DuplicateOf' not in self.pics_df:
+            return pd.Series(dtype=object)
+        return self.pics_df['DuplicateOf'].dropna()
+    
+    def locations(self, df: pd.DataFrame) -> list:
+        # Where each picture is now: its destination once it has been moved
+        return [dest if dest is not None and os.path.exists(dest) else path
+                for path, dest in zip(df.index, df['DestinationPath'])]
+    
+    def moved_paths(self) -> set:
+        # Real paths of the catalogued pictures at their destination
+        if 'DestinationPath' not in self.pics_df:
+            return set()
+        return {os.path.realpath(dest) for dest in self.pics_df['DestinationPath'].dropna()}
+    
+    def io_order(self, items: list, key=None) -> list:
+        if not self.physical_order:
+            return items
+        with self.instruments.timer('scheduling'):
+            return layout.physical_order(items, key)
+    
+    def controller(self, pool: str, stage: str = None):
+        # One controller per pool for the whole session, so later jobs start
+        # from the limit earlier ones settled on. None when the stage has a
+        # fixed worker count or everything runs in-process
+        workers = self.process_pool.max_workers
+        if not self.adaptive or workers == 0 or (stage and self.stage_workers[stage]):
+            return None
+        if pool not in self.controllers:
+            self.controllers[pool] = concurrency.Controller(pool, workers, 2*workers,
+                                                            instruments=self.instruments)
+        return self.controllers[pool]
+    
+    def prefetcher(self, classify: bool = False, micro: bool = False):
+        return prefetch.Prefetcher(classify, micro) if self.readahead else None
+    
+    def is_cancelled(self, cancel_token) -> bool:
+        return cancel_token is not None and cancel_token.cancelled
+    
+    def send_partial(self, partial_callback, batch: pd.DataFrame) -> None:
+        if partial_callback is not None and len(batch):
+            partial_callback(batch.copy())
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+# Minimal FITS support: reading and writing header cards, memory-mapped
+# access to the primary image and writing single-image files
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+BLOCK = 2880
+CARD = 80
+# Data unit types by BITPIX; FITS is always big-endian
+DTYPES = {8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}
+
+def card(key: str, value, comment: str = None) -> str:
+    # Strings start in column 11, other values end in column 30
+    if isinstance(value, str):
+        value = "'" + value.replace("'", "''").ljust(8) + "'"
+        text = f'{key:<8}= {value:<20}'
+    else:
+        value = ('T' if value else 'F') if isinstance(value, bool) else value
+        text = f'{key:<8}= {value:>20}'
+    if comment:
+        text += f' / {comment}'
+    return text[:CARD].ljust(CARD)
+
+def header_block(cards: list) -> bytes:
+    # cards: [(key, value)] in order, after the mandatory SIMPLE/BITPIX/NAXISn
+    text = ''.join(card(key, value) for key, value in cards) + 'END'.ljust(CARD)
+    return text.ljust(-(-len(text)//BLOCK)*BLOCK).encode('ascii')
+
+def parse_value(text: str):
+    text = text.strip()
+    if text.startswith("'"):
+        return text[1:text.rindex("'")].replace("''", "'").rstrip() if text.count("'") > 1 else text[1:]
+    text = text.split('/', 1)[0].strip()
+    if text in ('T', 'F'):
+        return text == 'T'
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text or None
+
+def read_header(f) -> tuple:
+    # Returns ({key: value}, header size in bytes) of the primary header
+    header, size = {}, 0
+    while True:
+        block = f.read(BLOCK)
+        if len(block) < BLOCK:
+            raise ValueError('FITS header ends before END')
+        size += BLOCK
+        for i in range(0, BLOCK, CARD):
+            text = block[i:i+CARD].decode('ascii', 'replace')
+            key = text[:8].strip()
+            if key == 'END':
+                return header, size
+            if text[8:10] == '= ':
+                header[key] = parse_value(text[10:])
+        if size == BLOCK and 'SIMPLE' not in header:
+            raise ValueError('Not a FITS file')
+
+def image_shape(header: dict) -> tuple:
+    # Data unit shape in file order, slowest axis first: (rows, cols) or
+    # (planes, rows, cols)
+    return tuple(header[f'NAXIS{i}'] for i in range(header.get('NAXIS', 0), 0, -1))
+
+def row_ranges(shape: tuple, bitpix: int, offset: int, step: int) -> list:
+    # [(offset, length)] of every step-th row of each plane of a data unit
+    # starting at offset, with adjacent rows merged into one range
+    if not shape:
+        return []
+    row = shape[-1] * abs(bitpix) // 8
+    rows = shape[-2] if len(shape) > 1 else 1
+    ranges = []
+    for plane in range(int(np.prod(shape[:-2], dtype=int))):
+        start = offset + plane * rows * row
+        for r in range(0, rows, step):
+            if ranges and ranges[-1][0] + ranges[-1][1] == start + r * row:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + row)
+            else:
+                ranges.append((start + r * row, row))
+    return ranges
+
+class ImageData(object):
+    # The primary image as (rows, cols[, channels]) without reading or
+    # converting it up front: the big-endian pixels stay a view of the mapped
+    # file, and BZERO/BSCALE are applied only to the pixels that are indexed
+    def __init__(self, raw: np.ndarray, header: dict):
+        self.raw = raw.transpose(1, 2, 0) if raw.ndim == 3 else raw
+        self.bzero = header.get('BZERO', 0)
+        self.bscale = header.get('BSCALE', 1)
+        self.bitpix = header['BITPIX']
+        self.shape = self.raw.shape
+        self.ndim = self.raw.ndim
+        self.dtype = self.scale(self.raw[:0]).dtype
+        self.nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def scale(self, data: np.ndarray) -> np.ndarray:
+        integral = data.dtype.kind in 'iu' and self.bscale == 1 and float(self.bzero).is_integer()
+        if not integral:
+            return data.astype(np.float32) * self.bscale + self.bzero
+        if self.bzero == 0:
+            return data.astype(data.dtype.newbyteorder('='))
+        if data.dtype.kind == 'i' and self.bzero == 2**(8*data.dtype.itemsize - 1):
+            # Unsigned data stored signed: flipping the sign bit adds BZERO
+            unsigned = data.view(data.dtype.str.replace('i', 'u'))
+            return unsigned ^ unsigned.dtype.type(self.bzero)
+        return data.astype(np.int64) + int(self.bzero)
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.scale(self.raw[key])
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+def open_image(filepath: str) -> ImageData:
+    with open(filepath, 'rb') as f:
+        header, size = read_header(f)
+    raw = np.memmap(filepath, dtype=DTYPES[header['BITPIX']], mode='r', offset=size,
+                    shape=image_shape(header))
+    return ImageData(raw, header)
+
+def buffer_image(buf) -> ImageData:
+    # Same as open_image over an already mapped file
+    buf.seek(0)
+    header, size = read_header(buf)
+    shape = image_shape(header)
+    raw = np.frombuffer(buf, dtype=DTYPES[header['BITPIX']], count=int(np.prod(shape)),
+                        offset=size)
+    return ImageData(raw.reshape(shape), header)
+
+def image_cards(shape: tuple, bitpix: int) -> list:
+    # FITS lists axes fastest first: (rows, cols) is NAXIS1=cols, NAXIS2=rows;
+    # colour images (rows, cols, channels) are stored as channel planes
+    axes = [shape[1], shape[0]] + list(shape[2:])
+    return ([('SIMPLE', True), ('BITPIX', bitpix), ('NAXIS', len(axes))] +
+            [(f'NAXIS{i+1}', n) for i, n in enumerate(axes)])
+
+def write_image(filepath: str, data: np.ndarray, cards: list = (), rows: int = 256) -> None:
+    # Writes float32 data (BITPIX -32) a band of rows at a time, so memmapped
+    # images are never loaded whole
+    shape = data.shape
+    with open(filepath, 'wb') as f:
+        f.write(header_block(image_cards(shape, -32) + list(cards)))
+        written = 0
+        planes = [data] if data.ndim == 2 else [data[..., c] for c in range(shape[2])]
+        for plane in planes:
+            for row in range(0, shape[0], rows):
+                band = np.asarray(plane[row:row+rows], dtype='>f4')
+                f.write(band.tobytes())
+                written += band.nbytes
+        f.write(b'\0' * (-written % BLOCK))
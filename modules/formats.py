@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+# Picture formats by file extension. Each format reads the metadata fields
+# from its own header, finds its embedded preview JPEG and/or decodes pixels
+# for classification, all from a read-only mapping of the file (see
+# tasks.map_file). Raw formats LibRaw can open are flagged, for the rawpy
+# fallbacks and for stacking the raw CFA data.
+
+import io
+import os
+import struct
+from datetime import datetime
+from fractions import Fraction
+
+from . import cr3, fits, tiff
+from .lazy import lazy_import
+
+exifread = lazy_import('exifread')
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+# Micro classification decodes the smallest embedded image of raw files, and
+# JPEGs at reduced scale, instead of the full preview
+MICRO_SIZE = (160, 120)
+# Size of the previews embedded in raw files, which formats without one are
+# sampled down to for classification
+PREVIEW_SIZE = (1620, 1080)
+
+class Format(object):
+    def __init__(self, name: str, extensions: tuple, metadata, preview=None, pixels=None,
+                 image=None, locate=None, raw: bool = False):
+        self.name = name
+        self.extensions = extensions
+        # metadata(f) -> {exifread tag name: value}, f a file object over the mapping
+        self.metadata = metadata
+        # preview(buf, smallest) -> embedded JPEG bytes or None
+        self.preview = preview
+        # pixels(buf, micro) -> array or None, for formats without a preview
+        self.pixels = pixels
+        # image(filepath) -> full-resolution array-like, where decoding the
+        # pixels for classification doesn't give the stored data
+        self.image = image
+        # locate(f, head, size, micro) -> [(offset, length)] classification
+        # will read, from the open file f of size bytes whose first bytes are
+        # head (for readahead, see prefetch.py)
+        self.locate = locate if locate is not None else whole_file
+        self.raw = raw
+
+def whole_file(f, head: bytes, size: int, micro: bool = False) -> list:
+    return [(0, size)]
+
+_formats = {}
+
+def register(fmt: Format) -> Format:
+    for ext in fmt.extensions:
+        _formats[ext] = fmt
+    return fmt
+
+def for_path(filepath: str) -> Format:
+    return _formats.get(os.path.splitext(filepath)[1].lower().lstrip('.'))
+
+def extensions() -> tuple:
+    return tuple(_formats)
+
+def decode(f, micro: bool = False) -> np.ndarray:
+    # JPEG draft mode decodes at 1/2-1/8 scale directly from the DCT
+    # coefficients; other formats ignore it
+    with Image.open(f) as im:
+        if micro:
+            im.draft('RGB', MICRO_SIZE)
+        return np.asarray(im)
+
+def exif_metadata(f) -> dict:
+    return exifread.process_file(f, details=False)
+
+def image_pixels(buf, micro: bool = False) -> np.ndarray:
+    buf.seek(0)
+    return decode(buf, micro)
+
+def exif_thumbnail(jpeg) -> bytes:
+    # The thumbnail in the EXIF (APP1) segment of a JPEG, or None
+    i = 2
+    while i + 4 <= len(jpeg) and jpeg[i] == 0xFF:
+        marker, length = jpeg[i+1], jpeg[i+2] << 8 | jpeg[i+3]
+        if marker == 0xE1 and bytes(jpeg[i+4:i+10]) == b'Exif\0\0':
+            return tiff.preview(bytes(jpeg[i+10:i+2+length]), smallest=True)
+        if marker == 0xDA:
+            break
+        i += 2 + length
+    return None
+
+# Fujifilm RAF: a 'FUJIFILMCCD-RAW' header with the big-endian offset and
+# length of a full-size JPEG (which carries the EXIF metadata) at byte 84
+RAF_MAGIC = b'FUJIFILMCCD-RAW'
+RAF_JPEG = 84
+EXIF_MAX = 128*1024
+
+def raf_jpeg(head) -> tuple:
+    if bytes(head[:len(RAF_MAGIC)]) != RAF_MAGIC:
+        raise ValueError('Not a Fujifilm RAF file')
+    return struct.unpack_from('>II', head, RAF_JPEG)
+
+def raf_metadata(f) -> dict:
+    offset, length = raf_jpeg(f.read(RAF_JPEG + 8))
+    f.seek(offset)
+    return exif_metadata(io.BytesIO(f.read(min(length, EXIF_MAX))))
+
+def raf_ranges(f, head: bytes, size: int, micro: bool = False) -> list:
+    # The EXIF thumbnail is near the start of the embedded JPEG
+    offset, length = raf_jpeg(head)
+    return [(offset, min(length, EXIF_MAX) if micro else length)]
+
+def raf_preview(buf, smallest: bool = False) -> bytes:
+    offset, length = raf_jpeg(buf)
+    data = buf[offset:offset+length]
+    if smallest:
+        data = exif_thumbnail(data) or data
+    return data if tiff.decodable_jpeg(data[:64*1024]) else None
+
+def cr3_metadata(f) -> dict:
+    # Every CMT box holds a bare TIFF, which exifread names as IFD0 ('Image ...')
+    res = {}
+    for prefix, block in cr3.tiff_blocks(f).items():
+        for name, value in exif_metadata(io.BytesIO(block)).items():
+            if name.startswith('Image '):
+                name = prefix + name[len('Image'):]
+            res[name] = value
+    return res
+
+# FITS headers have no EXIF; these cards stand in for the fields sorting uses
+FITS_FIELDS = {
+    'Image DateTime': ('DATE-OBS',),
+    'EXIF ExposureTime': ('EXPTIME', 'EXPOSURE'),
+    'EXIF ISOSpeedRatings': ('ISOSPEED', 'GAIN'),
+    'EXIF FNumber': ('FOCRATIO',),
+    'EXIF FocalLength': ('FOCALLEN',),
+    'Image ImageWidth': ('NAXIS1',),
+    'Image ImageLength': ('NAXIS2',),
+    'Image Model': ('INSTRUME',),
+    'EXIF LensModel': ('TELESCOP',),
+    }
+
+def fits_value(tag: str, value):
+    if tag == 'Image DateTime':
+        return datetime.fromisoformat(str(value)[:19]).strftime('%Y:%m:%d %H:%M:%S')
+    if tag == 'EXIF ExposureTime':
+        return Fraction(value).limit_denominator(10000)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def fits_metadata(f) -> dict:
+    header, size = fits.read_header(f)
+    res = {}
+    for tag, keys in FITS_FIELDS.items():
+        value = next((header[key] for key in keys if header.get(key) is not None), None)
+        if value is not None:
+            try:
+                res[tag] = fits_value(tag, value)
+            except ValueError:
+                pass
+    return res
+
+def fits_step(width: int, micro: bool = False) -> int:
+    return max(1, width // (MICRO_SIZE if micro else PREVIEW_SIZE)[0])
+
+def fits_ranges(f, head: bytes, size: int, micro: bool = False) -> list:
+    # The header blocks and only the rows fits_pixels samples
+    f.seek(0)
+    header, offset = fits.read_header(f)
+    shape = fits.image_shape(header)
+    step = fits_step(shape[-1], micro) if shape else 1
+    return [(0, offset)] + fits.row_ranges(shape, header['BITPIX'], offset, step)
+
+def fits_pixels(buf, micro: bool = False) -> np.ndarray:
+    # Every nth row and column straight from the mapping, at the size of a raw
+    # preview, scaled to the 8-bit range of JPEG previews. Mono frames become
+    # a grey RGB view, so the dark threshold means the same as for colour
+    image = fits.buffer_image(buf)
+    step = fits_step(image.shape[1], micro)
+    sample = image[::step, ::step]
+    if image.bitpix != 8:
+        sample = sample * np.float32(1/256)
+    return sample if sample.ndim == 3 else np.broadcast_to(sample[..., None], sample.shape + (3,))
+
+register(Format('Image', ('jpg', 'jpeg', 'png', 'tif', 'tiff', 'bmp'), exif_metadata,
+                pixels=image_pixels))
+# TIFF-based raw files keep their previews in IFDs (see tiff.py)
+for name, exts in (('Canon CR2', ('cr2',)), ('Nikon NEF', ('nef', 'nrw')),
+                   ('Sony ARW', ('arw', 'sr2', 'srf')), ('Adobe DNG', ('dng',)),
+                   ('Pentax PEF', ('pef',)), ('Olympus ORF', ('orf',)),
+                   ('Panasonic RW2', ('rw2',))):
+    register(Format(name, exts, exif_metadata, preview=tiff.preview, raw=True,
+                    locate=lambda f, head, size, micro: tiff.preview_ranges(head, size, micro)))
+register(Format('Canon CR3', ('cr3',), cr3_metadata, preview=cr3.preview, raw=True,
+                locate=lambda f, head, size, micro: cr3.preview_ranges(f, micro)))
+register(Format('Fujifilm RAF', ('raf',), raf_metadata, preview=raf_preview, raw=True,
+                locate=raf_ranges))
+register(Format('FITS', ('fits', 'fit', 'fts'), fits_metadata, pixels=fits_pixels,
+                image=fits.open_image, locate=fits_ranges))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Per-stage timing for the picture pipeline. Each stage (discovery, disk
+# order scheduling, readahead, EXIF parsing, dtype coercion, duplicate
+# hashing, grouping, thumbnail decoding, pixel reduction, file transfer, copy
+# verification, stacking) collects one monotonic sample per file or batch
+# plus the bytes it read, and reports p50/p95/max per stage.
+#
+# Picture functions in tasks.py record into `local`, the collector of whatever
+# process they run in; pool.run_chunk drains it after every chunk so worker
+# samples travel back with the results and are merged into the engine's
+# Instruments.
+
+import io
+import math
+import time
+import cProfile
+from contextlib import contextmanager
+from threading import Lock
+
+STAGES = ('discovery', 'scheduling', 'readahead', 'exif_parse', 'dtype_coercion', 'hashing', 'grouping',
+          'thumbnail_decode', 'pixel_reduction', 'file_transfer', 'verification',
+          'stack_load', 'stack_combine')
+
+class Sample(object):
+    # Yielded by Instruments.timer so the timed code can report bytes read
+    def __init__(self):
+        self.nbytes = 0
+
+class Instruments(object):
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.seconds = {}
+            self.nbytes = {}
+            self.concurrency = {}
+
+    def set_concurrency(self, pool: str, values: dict) -> None:
+        # Latest limits chosen by an adaptive controller (see concurrency.py)
+        with self._lock:
+            self.concurrency[pool] = values
+
+    def concurrency_report(self) -> dict:
+        with self._lock:
+            return {pool: dict(values) for pool, values in self.concurrency.items()}
+
+    @contextmanager
+    def timer(self, stage: str, nbytes: int = 0):
+        sample = Sample()
+        sample.nbytes = nbytes
+        t0 = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            self.add(stage, time.perf_counter() - t0, sample.nbytes)
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0) -> None:
+        with self._lock:
+            self.seconds.setdefault(stage, []).append(seconds)
+            self.nbytes[stage] = self.nbytes.get(stage, 0) + nbytes
+
+    def drain(self) -> dict:
+        # Hand over everything collected so far (picklable) and start again
+        with self._lock:
+            samples = {stage: (self.seconds[stage], self.nbytes[stage]) for stage in self.seconds}
+            self.seconds, self.nbytes = {}, {}
+        return samples
+
+    def merge(self, samples: dict) -> None:
+        with self._lock:
+            for stage, (seconds, nbytes) in samples.items():
+                self.seconds.setdefault(stage, []).extend(seconds)
+                self.nbytes[stage] = self.nbytes.get(stage, 0) + nbytes
+
+    def report(self) -> dict:
+        # Stages in pipeline order, then anything else that was recorded
+        with self._lock:
+            stages = [s for s in STAGES if s in self.seconds]
+            stages += [s for s in self.seconds if s not in STAGES]
+            report = {}
+            for stage in stages:
+                seconds = sorted(self.seconds[stage])
+                report[stage] = {
+                    'count': len(seconds),
+                    'total_s': round(sum(seconds), 4),
+                    'p50_ms': round(percentile(seconds, 50) * 1000, 3),
+                    'p95_ms': round(percentile(seconds, 95) * 1000, 3),
+                    'max_ms': round(seconds[-1] * 1000, 3),
+                    'bytes': self.nbytes[stage],
+                    }
+        return report
+
+    def summary(self) -> str:
+        lines = [f'{"stage":<18}{"count":>8}{"total s":>10}{"p50 ms":>10}'
+                 f'{"p95 ms":>10}{"max ms":>10}{"MB read":>10}']
+        for stage, row in self.report().items():
+            lines.append(f'{stage:<18}{row["count"]:>8}{row["total_s"]:>10.3f}'
+                         f'{row["p50_ms"]:>10.3f}{row["p95_ms"]:>10.3f}'
+                         f'{row["max_ms"]:>10.3f}{row["bytes"]/1e6:>10.1f}')
+        concurrency = self.concurrency_report()
+        if concurrency:
+            lines.append(f'{"pool":<18}{"limit":>8}{"min":>10}{"max":>10}{"up":>10}'
+                         f'{"down":>10}{"items/s":>10}')
+        for pool, row in concurrency.items():
+            lines.append(f'{pool:<18}{row["limit"]:>8}{row["min"]:>10}{row["max"]:>10}'
+                         f'{row["increases"]:>10}{row["decreases"]:>10}{row["items_per_s"]:>10.1f}')
+        return '\n'.join(lines)
+
+def percentile(ordered: list, pct: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered)))) - 1
+    return ordered[rank]
+
+class CountingFile(io.RawIOBase):
+    # Wraps an open binary file and counts the bytes read through it
+    def __init__(self, f):
+        self._f = f
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        count = self._f.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._f.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+@contextmanager
+def profile(path: str = None):
+    # Opt-in cProfile of the calling process, dumped for pstats/snakeviz.
+    # Work done in worker processes isn't included: profile with --workers 0,
+    # or sample every process with py-spy (py-spy record --subprocesses)
+    if path is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+# Collector for the current process (see the note at the top)
+local = Instruments()
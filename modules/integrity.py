@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Verified copies for unreliable destinations (USB drives, network shares).
+# The source is hashed while it is copied, so it is only read once; then the
+# destination is read back past the page cache (O_DIRECT, or fsync plus
+# POSIX_FADV_DONTNEED where O_DIRECT isn't supported) so the hash reflects
+# what actually reached the disk. The checksum is stored in the catalog, so
+# a later `astrosorter verify` only needs to read the destinations.
+
+import os
+import mmap
+import shutil
+
+from .duplicates import new_hash
+from .instrument import local
+
+READ_SIZE = 1024*1024
+
+class IntegrityError(OSError):
+    pass
+
+def copy_verified(src: str, dest: str) -> str:
+    h = new_hash()
+    buf = bytearray(READ_SIZE)
+    view = memoryview(buf)
+    with local.timer('file_transfer') as sample:
+        with open(src, 'rb', buffering=0) as fsrc, open(dest, 'wb', buffering=0) as fdest:
+            while True:
+                count = fsrc.readinto(buf)
+                if not count:
+                    break
+                h.update(view[:count])
+                fdest.write(view[:count])
+                sample.nbytes += count
+            os.fsync(fdest.fileno())
+        shutil.copymode(src, dest)
+    checksum = h.hexdigest()
+    if file_hash(dest, uncached=True) != checksum:
+        os.remove(dest)
+        raise IntegrityError(f'{dest} does not match {src} after copying')
+    return checksum
+
+def file_hash(filepath: str, uncached: bool = False) -> str:
+    with local.timer('verification') as sample:
+        if uncached:
+            try:
+                digest, sample.nbytes = direct_hash(filepath)
+                return digest
+            except (OSError, AttributeError):
+                # No O_DIRECT here (e.g. tmpfs, macOS, Windows)
+                drop_cache(filepath)
+        h = new_hash()
+        buf = bytearray(READ_SIZE)
+        view = memoryview(buf)
+        with open(filepath, 'rb', buffering=0) as f:
+            while True:
+                count = f.readinto(buf)
+                if not count:
+                    break
+                h.update(view[:count])
+                sample.nbytes += count
+    return h.hexdigest()
+
+def direct_hash(filepath: str) -> tuple:
+    # O_DIRECT needs a page-aligned buffer, which an anonymous mmap is
+    fd = os.open(filepath, os.O_RDONLY | os.O_DIRECT)
+    buf = mmap.mmap(-1, READ_SIZE)
+    view = memoryview(buf)
+    try:
+        h, total = new_hash(), 0
+        while True:
+            count = os.readv(fd, [buf])
+            if not count:
+                break
+            h.update(view[:count])
+            total += count
+        return h.hexdigest(), total
+    finally:
+        view.release()
+        buf.close()
+        os.close(fd)
+
+def drop_cache(filepath: str) -> None:
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def verify_file(entry: tuple) -> bool:
+    filepath, checksum = entry
+    return file_hash(filepath, uncached=True) == checksum
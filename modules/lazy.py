@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import importlib
+from threading import Thread, Lock
+
+# Seconds spent importing each lazy module, for the import profile report
+load_times = {}
+_lock = Lock()
+
+class LazyModule(object):
+    # Stands in for a heavy module and imports it on first attribute access
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        
+    def _load(self):
+        if self._module is None:
+            self._module = load(self._name)
+        return self._module
+        
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+    
+    def __repr__(self) -> str:
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+def load(name: str):
+    # A module another thread is still importing is in sys.modules already;
+    # import_module waits for it to finish instead of returning it half-done
+    module = sys.modules.get(name)
+    if module is not None and not getattr(getattr(module, '__spec__', None), '_initializing', False):
+        return module
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        load_times.setdefault(name, time.perf_counter() - t0)
+    return module
+
+def warm_up(names: list, callback=None) -> Thread:
+    # Import modules in a background thread so they are ready before first use
+    def run():
+        for name in names:
+            try:
+                load(name)
+            except ImportError as ex:
+                print(f'Unable to warm up {name}: {ex}')
+        if callback is not None:
+            callback()
+    thread = Thread(target=run, name='lazy-import-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+def report() -> str:
+    with _lock:
+        times = sorted(load_times.items(), key=lambda item: item[1], reverse=True)
+    lines = [f'{"Module":<20}{"Import time":>12}']
+    lines += [f'{name:<20}{seconds*1000:>9.1f} ms' for name, seconds in times]
+    lines.append(f'{"Total":<20}{sum(t for n, t in times)*1000:>9.1f} ms')
+    return '\n'.join(lines)
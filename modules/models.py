@@ -1,36 +1,312 @@
 # -*- coding: utf-8 -*-
+from __future__ import annotations
 
-from PyQt5.QtCore import QAbstractTableModel, Qt
+import re
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+def to_numbers(column: pd.Series) -> tuple:
+    # Float value of every cell (NaN where it is missing or not a number),
+    # fractions like '1/100' included, and which cells are present
+    present = column.notna().to_numpy()
+    numbers = np.full(len(column), np.nan)
+    values = column[present]
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        numbers[present] = values.to_numpy(dtype=float)
+    elif len(values):
+        text = values.astype(str).str.strip()
+        parsed = pd.to_numeric(text, errors='coerce').astype(float)
+        fraction = parsed.isna() & text.str.contains('/', regex=False)
+        if fraction.any():
+            parts = text[fraction].str.split('/', n=1, expand=True)
+            numerator = pd.to_numeric(parts[0], errors='coerce')
+            denominator = pd.to_numeric(parts[1], errors='coerce')
+            parsed[fraction] = numerator / denominator.where(denominator != 0)
+        numbers[present] = parsed.to_numpy()
+    return numbers, present
+
+def to_strings(column: pd.Series) -> np.ndarray:
+    present = column.notna().to_numpy()
+    strings = np.full(len(column), None, dtype=object)
+    strings[present] = column[present].astype(str).to_numpy()
+    return strings
+
+class TypedColumn(object):
+    # Sort key of one column: numeric-looking columns sort as floats, others
+    # as strings. Rows are retyped as they change instead of the whole column
+    def __init__(self, column: pd.Series):
+        self.numbers, self.present = to_numbers(column)
+        self.strings = None
+    
+    @property
+    def numeric(self) -> bool:
+        return self.present.any() and not np.isnan(self.numbers[self.present]).any()
+    
+    def update(self, positions: np.ndarray, column: pd.Series) -> None:
+        # column is the whole (possibly longer) column; only positions changed
+        size = len(column)
+        if size > len(self.numbers):
+            grow = size - len(self.numbers)
+            self.numbers = np.concatenate([self.numbers, np.full(grow, np.nan)])
+            self.present = np.concatenate([self.present, np.zeros(grow, dtype=bool)])
+            if self.strings is not None:
+                self.strings = np.concatenate([self.strings, np.full(grow, None, dtype=object)])
+        values = column.iloc[positions]
+        self.numbers[positions], self.present[positions] = to_numbers(values)
+        if self.strings is not None:
+            self.strings[positions] = to_strings(values)
+    
+    def key(self, column: pd.Series) -> np.ndarray:
+        # Missing cells are NaN (numbers) or None (strings)
+        if self.numeric:
+            return self.numbers
+        if self.strings is None:
+            self.strings = to_strings(column)
+        return self.strings
 
 class PandasModel(QAbstractTableModel):
-    def __init__(self, data):
+    # Rows are exposed to the view in chunks as it scrolls (canFetchMore/fetchMore)
+    chunk_size = 500
+
+    def __init__(self, data, alert=None):
         QAbstractTableModel.__init__(self)
+        self.alert = alert if alert is not None else print
         self._data = data
-        
-    def rowCount(self, parent=None):
-        return self._data.shape[0]
+        self._typed = {}
+        self._filter = None
+        self._sort_column = None
+        self._sort_order = Qt.AscendingOrder
+        self._numeric = None
+        self._rows = np.arange(len(data))
+        self._loaded = min(len(self._rows), self.chunk_size)
 
-    def columnCount(self, parent=None):
-        return self._data.shape[1]
+    def rowCount(self, parent=QModelIndex()):
+        # Cells of a table have no children
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._data.shape[1]
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
             return
         if role == Qt.DisplayRole:
-            val = self._data.iloc[index.row(), index.column()]
+            val = self._data.iat[self._rows[index.row()], index.column()]
             val = f'{val:.1f}' if type(val) is float else val
             return str(val)
-        if role == Qt.EditRole:
-            try:
-                return eval(self._data.iloc[index.row(), index.column()])
-            except:
-                return str(self._data.iloc[index.row(), index.column()])
         if role == Qt.TextAlignmentRole:
             return Qt.AlignCenter
         return None
-    
+
     def headerData(self, col, orientation, role):
         if orientation == Qt.Horizontal and role == Qt.DisplayRole:
             return self._data.columns[col]
         return None
-    
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(len(self._rows) - self._loaded, self.chunk_size)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    # =============================================================================
+    # UPDATING
+    # =============================================================================
+    def set_data(self, data: pd.DataFrame) -> None:
+        self.beginResetModel()
+        self._data = data
+        self._typed = {}
+        self._rows = self.arrange()
+        self._loaded = min(len(self._rows), self.chunk_size)
+        self.endResetModel()
+
+    def update_data(self, data: pd.DataFrame) -> None:
+        # Diff against the current frame so the view keeps its state; only
+        # removed rows or changed columns need a full reset
+        old = self._data
+        if not data.columns.equals(old.columns) or not old.index.isin(data.index).all():
+            return self.set_data(data)
+        added = data.index.difference(old.index, sort=False)
+        data = data.loc[old.index.append(added)]
+        current = data.iloc[:len(old)]
+        same = (current.values == old.values) | (current.isna().values & old.isna().values)
+        changed = np.flatnonzero(~same.all(axis=1))
+        self._data = data
+        positions = np.concatenate([changed, np.arange(len(old), len(data))])
+        self.retype(positions)
+        self.rows_changed(changed)
+        self.rows_added(len(added))
+        if len(positions):
+            self.rearrange(positions)
+
+    def upsert_data(self, batch: pd.DataFrame) -> None:
+        # Merge a batch keyed by index without diffing the whole frame:
+        # known rows are overwritten in place and new rows are appended
+        batch = batch.reindex(columns=self._data.columns)
+        batch = batch[~batch.index.duplicated(keep='last')]
+        positions = self._data.index.get_indexer(batch.index)
+        known = positions >= 0
+        changed = positions[known]
+        if len(changed):
+            self._data.iloc[changed] = batch[known].to_numpy()
+        if not known.all():
+            self._data = pd.concat([self._data, batch[~known]])
+        added = int((~known).sum())
+        positions = np.concatenate([changed, np.arange(len(self._data) - added, len(self._data))])
+        self.retype(positions)
+        self.rows_changed(changed)
+        self.rows_added(added)
+        if len(positions):
+            self.rearrange(positions)
+
+    def rows_changed(self, positions: np.ndarray) -> None:
+        # Repaint changed rows in place
+        view_rows = np.full(len(self._data), -1)
+        view_rows[self._rows] = np.arange(len(self._rows))
+        changed_rows = view_rows[positions]
+        changed_rows = changed_rows[(changed_rows >= 0) & (changed_rows < self._loaded)]
+        if len(changed_rows):
+            top_left = self.index(int(changed_rows.min()), 0)
+            bottom_right = self.index(int(changed_rows.max()), self.columnCount() - 1)
+            self.dataChanged.emit(top_left, bottom_right)
+
+    def rows_added(self, count: int) -> None:
+        # New rows (the last `count` rows of the frame) stream in at the bottom
+        # of the view until the first chunk is full; the rest wait for fetchMore
+        if count <= 0:
+            return
+        first = self._loaded
+        fully_loaded = first == len(self._rows)
+        new_rows = np.arange(len(self._data) - count, len(self._data))
+        self._rows = np.concatenate([self._rows, new_rows])
+        count = min(count, self.chunk_size - first) if fully_loaded else 0
+        if count > 0:
+            self.beginInsertRows(QModelIndex(), first, first + count - 1)
+            self._loaded += count
+            self.endInsertRows()
+
+    def rearrange(self, positions: np.ndarray = None) -> None:
+        # Sorted or filtered views are rearranged without a reset when possible;
+        # with positions, only those rows are placed again
+        if self._sort_column is None and self._filter is None:
+            return
+        rows = self.arrange() if positions is None else self.merge(positions)
+        if len(rows) == len(self._rows):
+            self.layoutAboutToBeChanged.emit()
+            self._rows = rows
+            self.layoutChanged.emit()
+        else:
+            self.beginResetModel()
+            self._rows = rows
+            self._loaded = min(len(rows), max(self._loaded, self.chunk_size))
+            self.endResetModel()
+
+    # =============================================================================
+    # SORTING AND FILTERING
+    # =============================================================================
+    @property
+    def permutation(self) -> np.ndarray:
+        # Positional rows of the underlying frame in view order (never a copy of the frame)
+        return self._rows
+
+    def source_row(self, row: int) -> int:
+        return int(self._rows[row])
+
+    def typed(self, column: int) -> TypedColumn:
+        # Columns are typed the first time they are sorted or filtered on
+        if column not in self._typed:
+            self._typed[column] = TypedColumn(self._data.iloc[:, column])
+        return self._typed[column]
+
+    def key(self, column: int) -> np.ndarray:
+        return self.typed(column).key(self._data.iloc[:, column])
+
+    def retype(self, positions: np.ndarray) -> None:
+        for column, typed in self._typed.items():
+            typed.update(positions, self._data.iloc[:, column])
+
+    def sort(self, column: int, order=Qt.AscendingOrder) -> None:
+        self._sort_column = column if 0 <= column < self.columnCount() else None
+        self._sort_order = order
+        self.layoutAboutToBeChanged.emit()
+        self._rows = self.arrange()
+        self.layoutChanged.emit()
+
+    def set_filter(self, expression: str = None) -> None:
+        # Filter expressions use DataFrame.eval syntax on the typed columns,
+        # e.g. "FrameType == 'Light' and ISOSpeedRatings >= 800". An invalid
+        # expression leaves the current filter in place
+        previous, self._filter = self._filter, expression or None
+        try:
+            rows = self.arrange()
+        except Exception as ex:
+            self._filter = previous
+            return self.alert(f'Invalid filter {expression!r}: {ex}')
+        self.beginResetModel()
+        self._rows = rows
+        self._loaded = min(len(self._rows), self.chunk_size)
+        self.endResetModel()
+
+    def filter_mask(self, positions: np.ndarray = None) -> np.ndarray:
+        # Only the columns the expression names are typed
+        positions = np.arange(len(self._data)) if positions is None else positions
+        names = set(re.findall(r'[A-Za-z_]\w*', self._filter))
+        columns = {name: self.key(i)[positions] for i, name in enumerate(self._data.columns)
+                   if name in names}
+        mask = np.asarray(pd.DataFrame(columns, index=range(len(positions))).eval(self._filter),
+                          dtype=bool)
+        return np.broadcast_to(mask, len(positions))
+
+    def sorted_rows(self, rows: np.ndarray) -> np.ndarray:
+        key = pd.Series(self.key(self._sort_column)[rows])
+        ascending = self._sort_order == Qt.AscendingOrder
+        order = key.sort_values(ascending=ascending, kind='mergesort', na_position='last')
+        return rows[order.index.to_numpy()]
+
+    def arrange(self) -> np.ndarray:
+        rows = np.arange(len(self._data))
+        if self._sort_column is not None:
+            self._numeric = self.typed(self._sort_column).numeric
+            rows = self.sorted_rows(rows)
+        if self._filter is not None:
+            rows = rows[self.filter_mask()[rows]]
+        return rows
+
+    def merge(self, positions: np.ndarray) -> np.ndarray:
+        # Take the given rows out of the current view and put them back where
+        # they belong: found by binary search in the sorted rows, so a batch
+        # costs O(batch log N) comparisons instead of a full sort
+        affected = np.zeros(len(self._data), dtype=bool)
+        affected[positions] = True
+        rows = self._rows[~affected[self._rows]]
+        new = np.flatnonzero(affected)
+        if self._filter is not None:
+            new = new[self.filter_mask(new)]
+        if self._sort_column is None:
+            return np.insert(rows, np.searchsorted(rows, new), new)
+        if self.typed(self._sort_column).numeric != self._numeric:
+            # The column turned numeric (or stopped being), so every row moves
+            return self.arrange()
+        key = self.key(self._sort_column)
+        new = self.sorted_rows(new)
+        # Rows without a value are at the end either way
+        present = int((~pd.isna(key[rows])).sum())
+        new_present = ~pd.isna(key[new])
+        head, keys = rows[:present], key[rows[:present]]
+        values = key[new[new_present]]
+        if self._sort_order == Qt.AscendingOrder:
+            index = np.searchsorted(keys, values, side='right')
+        else:
+            index = len(keys) - np.searchsorted(keys[::-1], values, side='left')
+        return np.concatenate([np.insert(head, index, new[new_present]), rows[present:],
+                               new[~new_present]])
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Streaming stages connected by bounded queues. Every stage runs its own
+# threads, taking items from the queue in front of it and putting its
+# outputs on the queue behind it. A full queue blocks the stage feeding it
+# (backpressure), so however many files there are only `capacity` items
+# wait between two stages, and a slow stage slows down its producers instead
+# of letting work pile up. Stages that need CPU hand their work to the
+# process pool, so their threads only wait on I/O or on the workers.
+
+import time
+import queue
+import threading
+
+# End of the stream, passed down the stages once the input is exhausted
+DONE = object()
+POLL = 0.05
+
+class Stage(object):
+    def __init__(self, name: str, fn, workers: int = 1, capacity: int = None, controller=None,
+                 count=None):
+        # fn(item) -> iterable of outputs, so a stage can drop, split or batch items.
+        # With a controller (see concurrency.py) only as many of the workers
+        # as it allows run at a time; count(item) is how much work an item is
+        # for its measurements (e.g. len for chunks of files), 1 by default
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.capacity = capacity if capacity is not None else 2*self.workers
+        self.controller = controller
+        self.count = count
+
+class Pipeline(object):
+    def __init__(self, stages: list, cancel_token=None):
+        self.stages = stages
+        self.cancel_token = cancel_token
+        self.error = None
+        self._stop = threading.Event()
+
+    def run(self, items):
+        # Yields the outputs of the last stage as they arrive. items is
+        # iterated in a thread of its own, so it can be a slow generator (e.g.
+        # walking a network share). On cancellation no new items are taken
+        # and queued ones are dropped; items already in a stage finish
+        queues = [queue.Queue(stage.capacity) for stage in self.stages]
+        queues.append(queue.Queue(self.stages[-1].capacity))
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0]), daemon=True)]
+        for stage, inbox, outbox in zip(self.stages, queues, queues[1:]):
+            running = [stage.workers, threading.Lock()]
+            threads += [threading.Thread(target=self.work, args=(stage, inbox, outbox, running),
+                                         daemon=True) for i in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self.get(queues[-1])
+                if item is DONE:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def feed(self, items, outbox: queue.Queue) -> None:
+        try:
+            for item in items:
+                if self.cancelled() or not self.put(outbox, item):
+                    break
+        except Exception as ex:
+            self.fail(ex)
+        self.put(outbox, DONE)
+
+    def work(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue, running: list) -> None:
+        while True:
+            item = self.get(inbox)
+            if item is DONE:
+                # Passed back for the stage's other threads
+                self.put(inbox, DONE)
+                break
+            if self.cancelled():
+                continue
+            controller = stage.controller
+            if controller is not None and not controller.acquire(self._stop.is_set):
+                return
+            try:
+                t0 = time.perf_counter()
+                outputs = list(stage.fn(item))
+                if controller is not None:
+                    units = stage.count(item) if stage.count is not None else 1
+                    controller.record(units, time.perf_counter() - t0)
+            except Exception as ex:
+                return self.fail(ex)
+            finally:
+                if controller is not None:
+                    controller.release()
+            for output in outputs:
+                if not self.put(outbox, output):
+                    return
+        count, lock = running
+        with lock:
+            running[0] -= 1
+            last = running[0] == 0
+        if last:
+            self.put(outbox, DONE)
+
+    def get(self, inbox: queue.Queue):
+        # DONE once the pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                return inbox.get(timeout=POLL)
+            except queue.Empty:
+                pass
+        return DONE
+
+    def put(self, outbox: queue.Queue, item) -> bool:
+        # Blocks while the next stage is behind; False once the pipeline is stopped
+        while not self._stop.is_set():
+            try:
+                outbox.put(item, timeout=POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fail(self, ex: Exception) -> None:
+        if self.error is None:
+            self.error = ex
+        self._stop.set()
+
+    def cancelled(self) -> bool:
+        return self.cancel_token is not None and self.cancel_token.cancelled
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import itertools
+import threading
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from . import instrument
+
+def run_chunk(fn, items: list, prefetcher=None) -> tuple:
+    # Runs in a worker process; exceptions are returned in place of results so
+    # one bad file doesn't lose the rest of the chunk. Timing samples recorded
+    # by fn come back alongside the results. A prefetcher (see prefetch.py)
+    # reads ahead of the item being processed
+    results = []
+    if prefetcher is not None:
+        prefetcher.start(items)
+    try:
+        for i, item in enumerate(items):
+            if prefetcher is not None:
+                prefetcher.advance(i)
+            try:
+                results.append(fn(item))
+            except Exception as ex:
+                results.append(ex)
+    finally:
+        if prefetcher is not None:
+            prefetcher.stop()
+    return results, instrument.local.drain()
+
+class ProcessPool(object):
+    # One long-lived process pool shared by every job in the session
+    def __init__(self, max_workers: int = None, instruments=None):
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.instruments = instruments
+        self._executor = None
+        self._lock = threading.Lock()
+        
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Processes are spawned on first use and then reused until shutdown
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+    
+    def run(self, fn, items: list, prefetcher=None) -> list:
+        # One chunk, waited for in the calling thread (e.g. a pipeline stage)
+        if self.max_workers == 0:
+            return self.collect(run_chunk(fn, items, prefetcher))
+        return self.collect(self.executor.submit(run_chunk, fn, items, prefetcher).result())
+    
+    def map_chunks(self, fn, items: list, chunk_size: int = 100,
+                   cancel_token=None, drain: bool = False, prefetcher=None,
+                   in_flight: int = None, controller=None):
+        # Yield (chunk, results) in submission order, keeping a bounded number of
+        # chunks in flight (two per worker unless in_flight says otherwise, or
+        # as many as an adaptive controller allows, see concurrency.py).
+        # On cancellation nothing new is submitted; chunks already running are
+        # abandoned, or waited for when drain is True (e.g. file moves, whose
+        # results must be recorded).
+        # items can be a generator, which is only advanced as chunks are
+        # submitted. max_workers == 0 runs everything in the calling thread.
+        items = iter(items)
+        chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+        if self.max_workers == 0:
+            for chunk in chunks:
+                if self.cancelled(cancel_token):
+                    return
+                yield chunk, self.collect(run_chunk(fn, chunk, prefetcher))
+            return
+        
+        in_flight = in_flight or 2*self.max_workers
+        pending = deque()
+        try:
+            while True:
+                limit = controller.limit if controller is not None else in_flight
+                while len(pending) < limit and not self.cancelled(cancel_token):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    future = self.executor.submit(run_chunk, fn, chunk, prefetcher)
+                    if controller is not None:
+                        future.add_done_callback(partial(self.record, controller, len(chunk),
+                                                         time.perf_counter()))
+                    pending.append((chunk, future))
+                if not pending:
+                    return
+                chunk, future = pending[0]
+                while not future.done():
+                    if self.cancelled(cancel_token):
+                        if not drain:
+                            return
+                        # Only stops chunks that haven't started yet
+                        for queued_chunk, queued in pending:
+                            queued.cancel()
+                    wait([future], timeout=0.05)
+                pending.popleft()
+                if not future.cancelled():
+                    yield chunk, self.collect(future.result())
+        finally:
+            for chunk, future in pending:
+                future.cancel()
+                
+    def record(self, controller, items: int, t_submit: float, future) -> None:
+        if not future.cancelled():
+            controller.record(items, time.perf_counter() - t_submit)
+    
+    def collect(self, output: tuple) -> list:
+        results, samples = output
+        if self.instruments is not None:
+            self.instruments.merge(samples)
+        return results
+    
+    def cancelled(self, cancel_token) -> bool:
+        return cancel_token is not None and cancel_token.cancelled
+    
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Readahead for the files a worker is about to parse. Files are otherwise
+# touched strictly one after another, so on HDDs and network shares each one
+# pays the full seek or round trip. While the current file is parsed, a
+# background thread reads the header of the next files and asks the kernel
+# (posix_fadvise WILLNEED) to fetch the byte ranges classification will
+# read, as located by their format (see formats.py). Where posix_fadvise is
+# missing (Windows, macOS) those ranges are read and discarded instead.
+#
+# The number of files kept in flight follows Little's law: the time it takes
+# to fetch a header divided by the time spent on each file, so fast local
+# disks get little readahead and slow shares more.
+
+import os
+import math
+import time
+import queue
+import threading
+
+from . import formats
+
+HEAD = 64*1024
+READ_BLOCK = 1024*1024
+MAX_DEPTH = 32
+# Weight of the newest measurement in the moving averages
+SMOOTHING = 0.2
+
+def average(current: float, sample: float) -> float:
+    return sample if current is None else current + SMOOTHING*(sample - current)
+
+def hint(filepath: str, classify: bool = False, micro: bool = False) -> None:
+    with open(filepath, 'rb', buffering=0) as f:
+        head = f.read(HEAD)
+        size = os.fstat(f.fileno()).st_size
+        if not classify or size <= len(head):
+            return
+        fmt = formats.for_path(filepath)
+        if fmt is None:
+            return
+        for offset, length in fmt.locate(f, head, size, micro):
+            length = min(length, size - offset)
+            if length <= 0:
+                continue
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+                continue
+            f.seek(offset)
+            while length > 0 and f.read(min(length, READ_BLOCK)):
+                length -= READ_BLOCK
+
+class Prefetcher(object):
+    # Created in the engine and pickled to the workers with each chunk;
+    # start() is called in the worker with the chunk's paths
+    def __init__(self, classify: bool = False, micro: bool = False):
+        self.classify = classify
+        self.micro = micro
+        self._thread = None
+
+    def __getstate__(self) -> dict:
+        return {'classify': self.classify, 'micro': self.micro}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def start(self, paths: list) -> None:
+        self.paths = paths
+        self.issued = 1
+        self.depth = 1
+        self.latency = None
+        self.service = None
+        self.t_last = None
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.work, daemon=True)
+        self._thread.start()
+
+    def advance(self, index: int) -> None:
+        # Called before the file at index is processed
+        now = time.perf_counter()
+        if self.t_last is not None:
+            self.service = average(self.service, now - self.t_last)
+        self.t_last = now
+        if self.latency is not None and self.service:
+            self.depth = max(1, min(MAX_DEPTH, math.ceil(self.latency / self.service) + 1))
+        end = min(len(self.paths), index + 1 + self.depth)
+        while self.issued < end:
+            self._queue.put(self.paths[self.issued])
+            self.issued += 1
+
+    def work(self) -> None:
+        while True:
+            path = self._queue.get()
+            if path is None or self._stopped.is_set():
+                return
+            t0 = time.perf_counter()
+            try:
+                hint(path, self.classify, self.micro)
+            except Exception:
+                # The file is reported when it's parsed
+                continue
+            self.latency = average(self.latency, time.perf_counter() - t0)
+
+    def stop(self) -> None:
+        # Files still queued are skipped
+        if self._thread is not None:
+            self._stopped.set()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
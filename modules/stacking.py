@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+# Master bias/dark/flat frames. Frames are decoded in the process pool
+# straight into a memory-mapped stack on disk (raw CFA data for raw files, so
+# nothing is demosaiced), then combined a band of rows at a time, so memory
+# use depends on the band size rather than on the number or size of frames.
+# Masters are written as 32-bit float FITS.
+
+import os
+import shutil
+import tempfile
+
+from . import formats, tasks
+from .fits import write_image
+from .instrument import local
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+rawpy = lazy_import('rawpy')
+
+METHODS = ('mean', 'median', 'sigma')
+# Rows copied into the stack at a time
+BAND = 256
+
+def load_frame(filepath: str) -> np.ndarray:
+    # FITS frames stay memory-mapped until they're copied into the stack
+    fmt = formats.for_path(filepath)
+    if fmt is not None and fmt.raw:
+        with rawpy.imread(filepath) as raw:
+            return raw.raw_image_visible.copy()
+    if fmt is not None and fmt.image is not None:
+        return fmt.image(filepath)
+    im = tasks.load_image(filepath)
+    if im is None:
+        raise ValueError(f'Could not load {filepath}')
+    return im
+
+def load_into(entry: tuple) -> bool:
+    # Decodes one frame into its slot of the stack file
+    filepath, stack_path, index, shape, dtype = entry
+    with local.timer('stack_load') as sample:
+        frame = load_frame(filepath)
+        if frame.shape != shape:
+            raise ValueError(f'{filepath} is {frame.shape}, expected {shape}')
+        offset = index * int(np.prod(shape)) * np.dtype(dtype).itemsize
+        slot = np.memmap(stack_path, dtype=dtype, mode='r+', offset=offset, shape=shape)
+        for row in range(0, shape[0], BAND):
+            slot[row:row+BAND] = frame[row:row+BAND]
+        slot.flush()
+        del slot
+        sample.nbytes = frame.nbytes
+    return True
+
+def combine(tile: np.ndarray, method: str, kappa: float = 3.0, iterations: int = 3) -> np.ndarray:
+    if method == 'mean':
+        return tile.mean(axis=0)
+    if method == 'median':
+        return np.median(tile, axis=0)
+    # Sigma clipping: drop values more than kappa standard deviations from
+    # the median (satellite trails, cosmic rays, hot pixels) and average the rest
+    for i in range(iterations):
+        center = np.nanmedian(tile, axis=0)
+        spread = np.nanstd(tile, axis=0)
+        clipped = np.abs(tile - center) > kappa*spread
+        if not clipped.any():
+            break
+        tile[clipped] = np.nan
+    return np.nanmean(tile, axis=0)
+
+def combine_rows(entry: tuple) -> bool:
+    stack_path, count, shape, dtype, good, rows, method, master_path = entry
+    with local.timer('stack_combine') as sample:
+        stack = np.memmap(stack_path, dtype=dtype, mode='r', shape=(count,) + shape)
+        tile = np.asarray(stack[good, rows[0]:rows[1]], dtype=np.float32)
+        master = np.memmap(master_path, dtype=np.float32, mode='r+', shape=shape)
+        master[rows[0]:rows[1]] = combine(tile, method)
+        master.flush()
+        sample.nbytes = tile.nbytes
+        del stack, master
+    return True
+
+def band_rows(count: int, shape: tuple, memory: int, workers: int) -> int:
+    # Rows per band so every worker's band (as float32, plus working copies
+    # for sorting and clipping) fits in its share of the memory budget
+    row_bytes = count * int(np.prod(shape[1:])) * 4 * 3
+    return max(1, min(shape[0], memory // max(1, workers) // row_bytes))
+
+def stack_frames(filepaths: list, master_path: str, method: str, process_pool,
+                 cancel_token=None, memory: int = 1024*1024**2, cards: list = (),
+                 alert=print) -> int:
+    # Returns the number of frames combined (0 if cancelled or nothing loaded);
+    # frames that can't be loaded are reported through alert
+    first = load_frame(filepaths[0])
+    shape, dtype = first.shape, first.dtype.str
+    del first
+    workdir = tempfile.mkdtemp(prefix='.stacking-', dir=os.path.dirname(master_path))
+    try:
+        stack_path = os.path.join(workdir, 'stack.dat')
+        master_tmp = os.path.join(workdir, 'master.dat')
+        count = len(filepaths)
+        np.memmap(stack_path, dtype=dtype, mode='w+', shape=(count,) + shape).flush()
+
+        entries = [(path, stack_path, i, shape, dtype) for i, path in enumerate(filepaths)]
+        good = []
+        for chunk, results in process_pool.map_chunks(load_into, entries, 1, cancel_token):
+            for entry, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    alert(f'Leaving {entry[0]} out of the master ({result})')
+                    continue
+                good.append(entry[2])
+        if not good or (cancel_token is not None and cancel_token.cancelled):
+            return 0
+
+        np.memmap(master_tmp, dtype=np.float32, mode='w+', shape=shape).flush()
+        rows = band_rows(len(good), shape, memory, process_pool.max_workers)
+        bands = [(stack_path, count, shape, dtype, sorted(good), (row, min(row+rows, shape[0])),
+                  method, master_tmp) for row in range(0, shape[0], rows)]
+        for chunk, results in process_pool.map_chunks(combine_rows, bands, 1, cancel_token):
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        if cancel_token is not None and cancel_token.cancelled:
+            return 0
+
+        master = np.memmap(master_tmp, dtype=np.float32, mode='r', shape=shape)
+        write_image(master_path, master, [('NCOMBINE', len(good)), ('COMBMETH', method.upper()),
+                                          *cards])
+        del master
+        return len(good)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
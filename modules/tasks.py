@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+# Picture functions that only depend on their arguments, so they can run in
+# the worker processes of pool.ProcessPool as well as in the GUI process
+
+import io
+import os
+import mmap
+import shutil
+from contextlib import contextmanager
+
+from . import formats
+from .formats import decode
+from .instrument import local, CountingFile
+from .integrity import copy_verified
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+rawpy = lazy_import('rawpy')
+
+def read_metadata(filepath: str, fields: tuple) -> dict:
+    with map_file(filepath) as buf:
+        return parse_metadata(filepath, buf, fields)
+
+def parse_metadata(filepath: str, buf: mmap.mmap, fields: tuple) -> dict:
+    # Each format reads its own header (see formats.py)
+    fmt = formats.for_path(filepath)
+    if fmt is None or buf is None:
+        return {}
+    with local.timer('exif_parse') as sample:
+        reader = CountingFile(buf)
+        tags = fmt.metadata(reader)
+        sample.nbytes = reader.bytes_read
+    return {k: str(v) for k, v in tags.items() if k in fields}
+
+def ingest(filepath: str, fields: tuple, classify: bool = False, threshold: int = 50,
+           micro: bool = False) -> tuple:
+    # Metadata and (optionally) the dark fraction from a single mapping of the
+    # file: the header is parsed from the mapped bytes, and the preview JPEG
+    # is sliced from the same pages instead of reopening the file.
+    # Returns (metadata, dark fraction or None)
+    with map_file(filepath) as buf:
+        if buf is None:
+            return {}, None
+        metadata = parse_metadata(filepath, buf, fields)
+        if not classify:
+            return metadata, None
+        with local.timer('thumbnail_decode') as sample:
+            im = mapped_image(filepath, buf, micro)
+            sample.nbytes = 0 if im is None else im.nbytes
+        return metadata, None if im is None else dark_fraction(im, threshold)
+
+@contextmanager
+def map_file(filepath: str):
+    # Read-only mapping of the whole file (None for empty files, which can't
+    # be mapped)
+    with open(filepath, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            buf = None
+    try:
+        yield buf
+    finally:
+        if buf is not None:
+            buf.close()
+
+def mapped_image(filepath: str, buf: mmap.mmap, micro: bool = False):
+    # Formats with an embedded preview are classified from it, the others
+    # from their decoded pixels. None if neither works (raw files without a
+    # usable preview fall back to rawpy when sorting)
+    fmt = formats.for_path(filepath)
+    if fmt is None:
+        return None
+    if fmt.preview is not None:
+        data = fmt.preview(buf, micro)
+        if data is not None:
+            return decode(io.BytesIO(data))
+    return None if fmt.pixels is None else fmt.pixels(buf, micro)
+
+def load_image(filepath: str, micro: bool = False):
+    fmt = formats.for_path(filepath)
+    if fmt is None:
+        return None
+    if fmt.raw:
+        with rawpy.imread(filepath) as raw:
+            return raw.postprocess(no_auto_bright=True)
+    if fmt.image is not None:
+        return np.asarray(fmt.image(filepath))
+    if fmt.pixels is None:
+        return None
+    with map_file(filepath) as buf:
+        return None if buf is None else fmt.pixels(buf, micro)
+
+def load_thumbnail(filepath: str, smallest: bool = False) -> np.ndarray:
+    # Decode the embedded preview the file's format finds (see formats.py)
+    # from a mapping of the file. Only files without one fall back to LibRaw,
+    # which raises rawpy.LibRawNoThumbnailError or
+    # rawpy.LibRawUnsupportedThumbnailError if there isn't a usable one
+    fmt = formats.for_path(filepath)
+    data = None
+    if fmt is not None and fmt.preview is not None:
+        with map_file(filepath) as buf:
+            data = None if buf is None else fmt.preview(buf, smallest)
+    if data is not None:
+        return decode(io.BytesIO(data))
+    with rawpy.imread(filepath) as raw:
+        thumb = raw.extract_thumb()
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        return decode(io.BytesIO(thumb.data), smallest)
+    return np.asarray(thumb.data)
+
+def condense_pixels(frame: np.ndarray) -> np.ndarray:
+    return frame.sum(axis=2).ravel() if frame.ndim == 3 else frame.ravel()
+
+def pct_dark(filepath: str, threshold: int = 50, micro: bool = False) -> float:
+    # Decoders read the file themselves, so the decoded size stands in for bytes read
+    with local.timer('thumbnail_decode') as sample:
+        fmt = formats.for_path(filepath)
+        if fmt is not None and fmt.raw:
+            im = load_thumbnail(filepath, smallest=micro)
+        else:
+            with map_file(filepath) as buf:
+                im = None if buf is None else mapped_image(filepath, buf, micro)
+        sample.nbytes = 0 if im is None else im.nbytes
+    if im is None:
+        raise ValueError(f'Could not load {filepath}')
+    return dark_fraction(im, threshold)
+
+def dark_fraction(im: np.ndarray, threshold: int = 50) -> float:
+    with local.timer('pixel_reduction'):
+        npix = im.shape[0]*im.shape[1]
+        flat = condense_pixels(im)
+        num_dark = np.count_nonzero(flat < threshold)
+    return num_dark / npix
+
+def transfer_file(transfer: tuple) -> str:
+    # Returns the checksum of verified copies (see integrity.py), else None
+    src, dest, copy, verify = transfer
+    if copy and verify:
+        return copy_verified(src, dest)
+    # A rename within a filesystem doesn't read the file
+    with local.timer('file_transfer', os.path.getsize(src) if copy else 0):
+        if copy:
+            shutil.copy(src, dest)
+        else:
+            os.rename(src, dest)
+    return None
@@ -4,14 +4,18 @@ import time
 import traceback, sys
 from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSlot, pyqtSignal
 
+from .engine import CancelToken
+
 class WorkerSignals(QObject):
     finished = pyqtSignal()
+    cancelled = pyqtSignal()
     error = pyqtSignal(tuple)
     send = pyqtSignal(object)
     message = pyqtSignal(str)
     result = pyqtSignal(object)
+    partial = pyqtSignal(object)
     progress = pyqtSignal(float)
-  
+    
 class Worker(QRunnable):
     def __init__(self, fn, *args, **kwargs):
         super(Worker, self).__init__()
@@ -19,9 +23,19 @@ class Worker(QRunnable):
         self.args = args
         self.kwargs = kwargs
         self.signals = WorkerSignals()
+        self.token = CancelToken()
         
         self.kwargs['message'] = self.signals.message
         self.kwargs['progress_callback'] = self.signals.progress
+        self.kwargs['partial_callback'] = self.signals.partial.emit
+        self.kwargs['cancel_token'] = self.token
+        
+    @property
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+        
+    def cancel(self) -> None:
+        self.token.cancel()
         
     @pyqtSlot()
     def run(self):
@@ -32,6 +46,9 @@ class Worker(QRunnable):
             exctype, value = sys.exc_info()[:2]
             self.signals.error.emit((exctype, value, traceback.format_exc()))
         else:
-            self.signals.result.emit(result)
+            if self.token.cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.result.emit(result)
         finally:
-            self.signals.finished.emit()
\ No newline at end of file
+            self.signals.finished.emit()
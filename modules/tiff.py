@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Finding the JPEG previews embedded in TIFF-based raw files (CR2, NEF, ARW,
+# DNG, ORF, RW2, ...) straight from their IFDs, so a preview can be sliced
+# out of a mapped file without LibRaw opening and parsing the whole raw.
+# Previews are referenced either by JPEGInterchangeFormat/Length or, with
+# JPEG compression, by a single strip (StripOffsets/StripByteCounts), in the
+# IFD chain or in SubIFDs.
+
+import struct
+
+# Header magic: TIFF (also CR2, NEF, ARW, DNG, PEF), Olympus ORF, Panasonic RW2
+MAGIC = (42, 0x4F52, 0x5352, 0x55)
+
+NEW_SUBFILE_TYPE = 0x00FE
+IMAGE_WIDTH = 0x0100
+COMPRESSION = 0x0103
+STRIP_OFFSETS = 0x0111
+STRIP_BYTE_COUNTS = 0x0117
+SUB_IFDS = 0x014A
+JPEG_OFFSET = 0x0201
+JPEG_LENGTH = 0x0202
+
+# Integer field types: BYTE, SHORT, LONG, IFD
+INT_TYPES = {1: 'B', 3: 'H', 4: 'I', 13: 'I'}
+MAX_IFDS = 64
+MAX_VALUES = 4096
+MAX_PREVIEW = 8*1024**2
+
+def byte_order(buf) -> str:
+    head = bytes(buf[:4])
+    if len(head) < 4 or head[:2] not in (b'II', b'MM'):
+        return None
+    order = '<' if head[:2] == b'II' else '>'
+    return order if struct.unpack(order + 'H', head[2:])[0] in MAGIC else None
+
+def read_ifd(buf, offset: int, order: str) -> tuple:
+    # Returns ({tag: values} for integer tags, offset of the next IFD)
+    count, = struct.unpack_from(order + 'H', buf, offset)
+    tags = {}
+    for i in range(count):
+        tag, kind, n, value = struct.unpack_from(order + 'HHI4s', buf, offset + 2 + 12*i)
+        if kind not in INT_TYPES or not 0 < n <= MAX_VALUES:
+            continue
+        fmt = f'{order}{n}{INT_TYPES[kind]}'
+        size = struct.calcsize(fmt)
+        if size <= 4:
+            tags[tag] = struct.unpack_from(fmt, value)
+        else:
+            pointer, = struct.unpack(order + 'I', value)
+            if pointer + size <= len(buf):
+                tags[tag] = struct.unpack_from(fmt, buf, pointer)
+    next_ifd, = struct.unpack_from(order + 'I', buf, offset + 2 + 12*count)
+    return tags, next_ifd
+
+def ifds(buf) -> list:
+    # Every IFD in the main chain and the SubIFDs below them, in file order
+    order = byte_order(buf)
+    if order is None:
+        return []
+    pending = [struct.unpack_from(order + 'I', buf, 4)[0]]
+    seen, found = set(), []
+    while pending and len(found) < MAX_IFDS:
+        offset = pending.pop(0)
+        if offset in seen or not 8 <= offset < len(buf) - 2:
+            continue
+        seen.add(offset)
+        try:
+            tags, next_ifd = read_ifd(buf, offset, order)
+        except struct.error:
+            continue
+        found.append(tags)
+        pending += list(tags.get(SUB_IFDS, ())) + [next_ifd]
+    return found
+
+def jpeg_ranges(buf, size: int = None) -> list:
+    # (offset, length) of every JPEG the IFDs point at; size is the file size
+    # when buf only holds its first bytes
+    size = len(buf) if size is None else size
+    ranges = []
+    for tags in ifds(buf):
+        if JPEG_OFFSET in tags and JPEG_LENGTH in tags:
+            ranges.append((tags[JPEG_OFFSET][0], tags[JPEG_LENGTH][0]))
+        compression = tags.get(COMPRESSION, (1,))[0]
+        strips, counts = tags.get(STRIP_OFFSETS, ()), tags.get(STRIP_BYTE_COUNTS, ())
+        if compression in (6, 7) and len(strips) == 1 and len(counts) == 1:
+            ranges.append((strips[0], counts[0]))
+    return [(offset, length) for offset, length in set(ranges)
+            if length > 0 and offset + length <= size]
+
+def preview_ranges(head, size: int, smallest: bool = False) -> list:
+    # Where preview() will probably look, from the first bytes of the file:
+    # their JPEGs can't be checked for decodability yet, so the lossless raw
+    # data (tens of MB, JPEG-compressed too in CR2 and DNG) is left out by size
+    ranges = sorted((r for r in jpeg_ranges(head, size) if r[1] <= MAX_PREVIEW),
+                    key=lambda r: r[1])
+    return ranges[:1] if smallest else ranges
+
+def decodable_jpeg(data) -> bool:
+    # Baseline or progressive JPEG; lossless JPEG (raw data in DNG/CR2 and
+    # some NEF) has an SOF3 frame that PIL can't decode
+    if bytes(data[:2]) != b'\xff\xd8':
+        return False
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return False
+        marker = data[i+1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xC0, 0xC1, 0xC2):
+            return True
+        if 0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) or marker in (0xD9, 0xDA):
+            return False
+        i += 2 + (data[i+2] << 8 | data[i+3])
+    return False
+
+def preview(buf, smallest: bool = False) -> bytes:
+    # The largest (or smallest) decodable embedded JPEG, or None
+    ranges = sorted(jpeg_ranges(buf), key=lambda r: r[1], reverse=not smallest)
+    for offset, length in ranges:
+        if decodable_jpeg(buf[offset:offset + min(length, 64*1024)]):
+            return buf[offset:offset+length]
+    return None
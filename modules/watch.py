@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Watching a capture folder for pictures that have been completely written.
+# On Linux this uses inotify (IN_CLOSE_WRITE/IN_MOVED_TO, so a file is only
+# reported once the camera software has closed or renamed it); elsewhere the
+# folder is polled and a file counts as written once its size and modification
+# time stop changing between two scans.
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+EVENT = struct.Struct('iIII')
+
+class PollingWatcher(object):
+    def __init__(self, location: str, is_pic, exclude: str = None, alert=print):
+        self.location = location
+        self.is_pic = is_pic
+        self.alert = alert
+        self.exclude = os.path.abspath(exclude) if exclude else None
+        self._sizes = {}
+        self._reported = set()
+
+    def excluded(self, path: str) -> bool:
+        return self.exclude is not None and os.path.abspath(path).startswith(self.exclude + os.sep)
+
+    def scan(self) -> list:
+        pics = []
+        for root, dirs, files in os.walk(self.location):
+            if self.excluded(os.path.join(root, '')):
+                dirs[:] = []
+                continue
+            pics += [os.path.join(root, f) for f in files if self.is_pic(f)]
+        return pics
+
+    def poll(self, timeout: float = 1.0) -> list:
+        # Report pictures whose size and mtime didn't change since the last scan
+        time.sleep(timeout)
+        ready, sizes = [], {}
+        for path in self.scan():
+            if path in self._reported:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            sizes[path] = (st.st_size, st.st_mtime)
+            if self._sizes.get(path) == sizes[path]:
+                ready.append(path)
+                self._reported.add(path)
+        self._sizes = sizes
+        return ready
+
+    def close(self) -> None:
+        pass
+
+class InotifyWatcher(PollingWatcher):
+    def __init__(self, location: str, is_pic, exclude: str = None, alert=print):
+        super(InotifyWatcher, self).__init__(location, is_pic, exclude, alert)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        self._ready = []
+        self.add_tree(location)
+
+    def add_tree(self, location: str) -> None:
+        # Watch every subfolder; files already there (e.g. written before the
+        # watch was added) are reported straight away
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        for root, dirs, files in os.walk(location):
+            if self.excluded(os.path.join(root, '')):
+                dirs[:] = []
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), mask)
+            if wd < 0:
+                self.alert(f'Unable to watch {root}: {os.strerror(ctypes.get_errno())}')
+                continue
+            self._dirs[wd] = root
+            self.add_ready([os.path.join(root, f) for f in files])
+
+    def add_ready(self, paths: list) -> None:
+        for path in paths:
+            if path not in self._reported and self.is_pic(path) and not self.excluded(path):
+                self._ready.append(path)
+                self._reported.add(path)
+
+    def poll(self, timeout: float = 1.0) -> list:
+        if not self._ready:
+            select.select([self._fd], [], [], timeout)
+        self.read_events()
+        ready, self._ready = self._ready, []
+        return ready
+
+    def read_events(self) -> None:
+        while True:
+            try:
+                data = os.read(self._fd, 64*1024)
+            except OSError as ex:
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                name = data[offset+EVENT.size:offset+EVENT.size+length].rstrip(b'\0')
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped: fall back to a full rescan
+                    self.add_ready(self.scan())
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                if wd not in self._dirs or not name:
+                    continue
+                path = os.path.join(self._dirs[wd], os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add_tree(path)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.add_ready([path])
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+def open_watcher(location: str, is_pic, exclude: str = None, alert=print) -> PollingWatcher:
+    # alert reports folders that can't be watched
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(location, is_pic, exclude, alert)
+        except (OSError, AttributeError) as ex:
+            alert(f'inotify unavailable ({ex}): polling {location} instead')
+    return PollingWatcher(location, is_pic, exclude, alert)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import mmap
+import struct
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures
+from modules import cr3
+
+def mapped(data: bytes) -> mmap.mmap:
+    buf = mmap.mmap(-1, len(data))
+    buf.write(data)
+    buf.seek(0)
+    return buf
+
+def frame() -> tuple:
+    im = fixtures.pixels('Light', 64, 48, np.random.default_rng(0))
+    return im, fixtures.cr3_frame(im, *fixtures.exif_entries('Light', 800, 0))
+
+def test_box_walk_finds_thumbnail_and_preview():
+    im, data = frame()
+    found = cr3.locate(io.BytesIO(data))
+    assert set(found) == {b'CMT1', b'CMT2', b'THMB', b'PRVW'}
+    for kind in (b'THMB', b'PRVW'):
+        start, length = found[kind]
+        size, = struct.unpack_from('>I', data, start + cr3.JPEG_LENGTH[kind])
+        assert data[start + cr3.JPEG_START:start + cr3.JPEG_START + 2] == b'\xff\xd8'
+        assert length == cr3.JPEG_START + size
+    # The mdat payload is never part of what is located
+    assert max(start + length for start, length in found.values()) < len(data) - im.nbytes
+    assert cr3.preview_ranges(io.BytesIO(data), smallest=True) == [found[b'THMB']]
+    assert cr3.preview_ranges(io.BytesIO(data)) == [found[b'PRVW'], found[b'THMB']]
+
+def test_preview_and_metadata():
+    im, data = frame()
+    assert cr3.preview(mapped(data)) == fixtures.jpeg_bytes(im)
+    thumb = fixtures.jpeg_bytes(np.ascontiguousarray(im[::4, ::4]))
+    assert cr3.preview(mapped(data), smallest=True) == thumb
+    blocks = cr3.tiff_blocks(io.BytesIO(data))
+    assert set(blocks) == {'Image', 'EXIF'}
+    assert all(block[:4] == b'II*\0' for block in blocks.values())
+
+def test_truncated_or_corrupt_input():
+    im, data = frame()
+    found = cr3.locate(io.BytesIO(data))
+    # Cut inside the PRVW box: the thumbnail is still used
+    start, length = found[b'PRVW']
+    cut = data[:start + length // 2]
+    assert b'PRVW' not in cr3.locate(io.BytesIO(cut))
+    assert cr3.preview(mapped(cut)) == cr3.preview(mapped(data), smallest=True)
+    for size in (0, 4, 12, 40):
+        assert cr3.locate(io.BytesIO(data[:size])) == {}
+    # Another brand, or a box shorter than its own header
+    assert cr3.locate(io.BytesIO(data.replace(b'crx ', b'isom', 1))) == {}
+    assert cr3.preview(mapped(data.replace(b'crx ', b'isom', 1))) is None
+    broken = bytearray(data)
+    struct.pack_into('>I', broken, 24, 4)
+    assert cr3.locate(io.BytesIO(bytes(broken))) == {}
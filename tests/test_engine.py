@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+import collections
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures
+from modules import duplicates, engine
+
+def frames(folder: str, count: int = 30) -> dict:
+    manifest = fixtures.generate(str(folder), count, 'tiff')
+    os.remove(os.path.join(str(folder), 'manifest.json'))
+    return manifest
+
+def new_engine(alerts: list = None) -> engine.Engine:
+    alerts = alerts if alerts is not None else []
+    return engine.Engine(notice=lambda text: None, alert=alerts.append, workers=0)
+
+def test_sort_again_with_output_inside_input(tmp_path):
+    # The default config sorts into the input folder, so analyzing it again
+    # finds the sorted pictures
+    frames(tmp_path)
+    eng = new_engine()
+    eng.analyze_pics(location=str(tmp_path))
+    eng.sort_pics()
+    eng.move_pics(False, str(tmp_path))
+    sorted_paths = dict(zip(eng.pics_df.index, eng.pics_df['DestinationPath']))
+    types = dict(zip(eng.pics_df.index, eng.pics_df['FrameType']))
+
+    eng.analyze_pics(location=str(tmp_path))
+    assert len(eng.pics_df) == 30
+    assert eng.pics_df['DuplicateOf'].isna().all()
+    eng.sort_pics()
+    eng.move_pics(False, str(tmp_path))
+    assert dict(zip(eng.pics_df.index, eng.pics_df['FrameType'])) == types
+    assert dict(zip(eng.pics_df.index, eng.pics_df['DestinationPath'])) == sorted_paths
+    assert all(os.path.exists(path) for path in sorted_paths.values())
+
+def test_copies_are_duplicates(tmp_path):
+    manifest = frames(tmp_path / 'a', 10)
+    copy = tmp_path / 'b'
+    copy.mkdir()
+    for path in manifest:
+        with open(path, 'rb') as src, open(copy / os.path.basename(path), 'wb') as dest:
+            dest.write(src.read())
+    eng = new_engine()
+    eng.analyze_pics(location=str(tmp_path))
+    duplicate_of = eng.pics_df['DuplicateOf'].dropna()
+    assert len(duplicate_of) == 10
+    assert all(path != original for path, original in duplicate_of.items())
+    eng.sort_pics()
+    labels = collections.Counter(eng.pics_df['FrameType'])
+    assert sum(labels.values()) == 20 and not labels['Dark or Light']
+
+def test_classify_moved_frames(tmp_path):
+    # As in watch mode: frames sorted by an earlier pass are classified where
+    # they were moved to once later frames turn them into dark or light frames
+    manifest = frames(tmp_path / 'source')
+    capture, output = tmp_path / 'capture', tmp_path / 'sorted'
+    capture.mkdir()
+    eng = new_engine()
+    paths = sorted(manifest)
+    for batch in (paths[:8], paths[8:]):
+        pics = []
+        for path in batch:
+            pics.append(str(capture / os.path.basename(path)))
+            os.replace(path, pics[-1])
+        eng.analyze_pics(pics=pics)
+        eng.sort_pics()
+        eng.move_pics(False, str(output))
+    assert 'Dark or Light' not in set(eng.pics_df['FrameType'])
+    assert not list(output.glob('*/Dark or Light'))
+
+def test_unreadable_frames_stay_in_place(tmp_path):
+    manifest = frames(tmp_path)
+    alerts = []
+    eng = new_engine(alerts)
+    eng.analyze_pics(location=str(tmp_path))
+    light = next(path for path, frame_type in manifest.items() if frame_type == 'Light')
+    with open(light, 'r+b') as f:
+        f.truncate(16)
+    eng.sort_pics()
+    eng.move_pics(False, str(tmp_path / 'sorted'))
+    assert eng.pics_df.loc[light, 'FrameType'] == 'Dark or Light'
+    assert eng.pics_df.loc[light, 'DestinationPath'] is None
+    assert os.path.exists(light)
+    assert not list((tmp_path / 'sorted').glob('*/Dark or Light'))
+
+def test_engine_does_not_import_pandas():
+    # The GUI creates its Engine before the first paint
+    code = ('import sys; from modules import engine; engine.Engine(workers=0); '
+            'print(" ".join(name for name in ("pandas", "numpy") if name in sys.modules))')
+    proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                          stdout=subprocess.PIPE, text=True)
+    assert proc.stdout.strip() == ''
+
+def test_unchanged_pictures_are_not_hashed_again(tmp_path, monkeypatch):
+    hashed = []
+    partial_hash = duplicates.partial_hash
+    monkeypatch.setattr(duplicates, 'partial_hash', lambda path: hashed.append(path) or partial_hash(path))
+    paths = sorted(frames(tmp_path, 20))
+    eng = new_engine()
+    eng.analyze_pics(pics=paths[:10])
+    assert sorted(hashed) == paths[:10]
+    hashed.clear()
+    eng.analyze_pics(pics=paths[10:])
+    assert sorted(hashed) == paths[10:]
+    hashed.clear()
+    os.utime(paths[0], ns=(0, 0))
+    eng.analyze_pics(pics=paths[:1])
+    assert hashed == paths[:1]
+
+def test_process_moves_every_frame(tmp_path):
+    manifest = frames(tmp_path / 'input')
+    eng = new_engine()
+    eng.process_pics(str(tmp_path / 'input'), str(tmp_path / 'output'))
+    assert len(eng.pics_df) == len(manifest)
+    for path, (dest, frame_type) in eng.pics_df[['DestinationPath', 'FrameType']].iterrows():
+        assert os.path.exists(dest) and not os.path.exists(path)
+        assert os.path.basename(os.path.dirname(dest)) == frame_type
+
+def test_conversion_failures_are_reported_once_per_job(tmp_path):
+    alerts = []
+    eng = new_engine(alerts)
+    pics = {str(tmp_path / f'IMG_{i}.tif'): {'EXIF ISOSpeedRatings': 'unknown',
+                                            'Image DateTime': '2020:10:18 21:00:00'}
+            for i in range(4)}
+    batches = [(list(pics)[:2], [(pics[path], None) for path in list(pics)[:2]]),
+               (list(pics)[2:], [(pics[path], None) for path in list(pics)[2:]])]
+    eng.batch_size = 2
+    frames = eng.collect_metadata(batches)
+    assert len(frames) == 2
+    assert f'Could not convert EXIF ISOSpeedRatings using {int}' in alerts
+    assert len(alerts) == len(set(alerts))
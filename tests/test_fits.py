@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import mmap
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures
+from modules import fits, formats
+
+def mapped(data: bytes) -> mmap.mmap:
+    buf = mmap.mmap(-1, len(data))
+    buf.write(data)
+    buf.seek(0)
+    return buf
+
+def frame(width: int, height: int) -> bytes:
+    im = fixtures.pixels('Light', width, height, np.random.default_rng(0))
+    return fixtures.fits_frame(im, 'Light', 800, 0)
+
+def test_ranges_cover_the_sampled_rows():
+    # Classifying from only the located bytes gives the same sample
+    data = frame(4000, 300)
+    for micro in (False, True):
+        ranges = formats.fits_ranges(io.BytesIO(data), data[:64*1024], len(data), micro)
+        located = bytearray(len(data))
+        for offset, length in ranges:
+            located[offset:offset+length] = data[offset:offset+length]
+        expected = formats.fits_pixels(mapped(data), micro)
+        assert np.array_equal(formats.fits_pixels(mapped(bytes(located)), micro), expected)
+        if micro:
+            assert sum(length for offset, length in ranges) < len(data) // 10
+
+def test_header_cards():
+    data = frame(64, 48)
+    header, size = fits.read_header(io.BytesIO(data))
+    assert size == fits.BLOCK and len(data) % fits.BLOCK == 0
+    assert header['BITPIX'] == 16 and header['SIMPLE'] is True
+    assert header['EXPTIME'] == 30.0 and header['IMAGETYP'] == 'Light Frame'
+    assert fits.image_shape(header) == (48, 64)
+
+def test_bzero_and_bscale():
+    # Unsigned 16-bit data is stored signed with BZERO 32768
+    mono = np.array([[0, 1, 32767], [32768, 40000, 65535]], dtype=np.uint16)
+    cards = fits.image_cards(mono.shape, 16) + [('BZERO', 32768)]
+    data = fits.header_block(cards) + (mono.astype(np.int32) - 32768).astype('>i2').tobytes()
+    image = fits.buffer_image(mapped(data))
+    assert image.dtype == np.uint16
+    assert np.array_equal(image[...], mono)
+    assert np.array_equal(image[::2, ::2], mono[::2, ::2])
+    # Other scalings are applied in float
+    raw = np.array([[-2, 0], [10, 100]], dtype='>i2')
+    cards = fits.image_cards(raw.shape, 16) + [('BZERO', 10), ('BSCALE', 0.5)]
+    image = fits.buffer_image(mapped(fits.header_block(cards) + raw.tobytes()))
+    assert np.allclose(image[...], raw * 0.5 + 10)
+
+def test_strided_sample_shape():
+    # Sampled down to the width of a raw preview (or micro thumbnail),
+    # mono frames as grey RGB
+    data = frame(4000, 300)
+    assert formats.fits_pixels(mapped(data)).shape == (150, 2000, 3)
+    assert formats.fits_pixels(mapped(data), micro=True).shape == (12, 160, 3)
+    assert formats.fits_pixels(mapped(frame(64, 48))).shape == (48, 64, 3)
+
+def test_truncated_or_corrupt_input():
+    data = frame(64, 48)
+    with pytest.raises(ValueError, match='END'):
+        fits.read_header(io.BytesIO(data[:fits.BLOCK - 1]))
+    with pytest.raises(ValueError, match='Not a FITS file'):
+        fits.read_header(io.BytesIO(b' ' * fits.BLOCK * 2))
+    with pytest.raises(ValueError):
+        fits.buffer_image(mapped(data[:fits.BLOCK + 100]))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('PyQt5.QtCore')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+from PyQt5 import QtCore
+from PyQt5.QtTest import QAbstractItemModelTester
+
+from modules import models
+
+def catalog(count: int = 20) -> pd.DataFrame:
+    paths = [f'/pictures/IMG_{i:04d}.CR2' for i in range(count)]
+    return pd.DataFrame({'FrameType': ['Light' if i % 2 else 'Dark' for i in range(count)],
+                         'ISOSpeedRatings': [str(100*(count - i)) for i in range(count)]},
+                        index=pd.Index(paths, name='Filepath'))
+
+def test_invalid_filter_keeps_previous_filter():
+    alerts = []
+    model = models.PandasModel(catalog(), alert=alerts.append)
+    model.set_filter("FrameType == 'Light'")
+    rows = model.permutation.copy()
+    model.set_filter("FrameType ==")
+    assert len(alerts) == 1
+    assert list(model.permutation) == list(rows)
+    assert model.rowCount() == 10
+    model.set_filter(None)
+    assert model.rowCount() == 20
+
+@pytest.fixture
+def checked(monkeypatch):
+    # Models wrapped in Qt's QAbstractItemModelTester, which checks every
+    # signal and row count against the model's answers and warns on mistakes
+    monkeypatch.setattr(models.PandasModel, 'chunk_size', 5)
+    warnings, testers = [], []
+    handler = lambda mode, context, message: warnings.append(message)
+    previous = QtCore.qInstallMessageHandler(handler)
+    def check(data: pd.DataFrame) -> models.PandasModel:
+        model = models.PandasModel(data, alert=warnings.append)
+        mode = QAbstractItemModelTester.FailureReportingMode.Warning
+        testers.append(QAbstractItemModelTester(model, mode))
+        return model
+    yield check
+    QtCore.qInstallMessageHandler(previous)
+    assert warnings == []
+
+def shown(model: models.PandasModel) -> list:
+    return [model._data.index[row] for row in model.permutation]
+
+def expected(data: pd.DataFrame) -> list:
+    # Light frames by ISO, highest first
+    lights = data[data['FrameType'] == 'Light']
+    return list(lights.index[np.argsort(-lights['ISOSpeedRatings'].astype(float), kind='stable')])
+
+def test_upsert_into_sorted_and_filtered_model(checked):
+    data = catalog()
+    model = checked(data.copy())
+    model.sort(1, QtCore.Qt.DescendingOrder)
+    model.set_filter("FrameType == 'Light'")
+    assert shown(model) == expected(data)
+    
+    # Changed rows move, a dark frame turns light, and new rows are merged in
+    batch = data.iloc[[1, 2, 7]].copy()
+    batch['ISOSpeedRatings'] = ['50', '1650', '3000']
+    batch.iloc[1, 0] = 'Light'
+    new = pd.DataFrame({'FrameType': ['Light', 'Dark', 'Light'],
+                        'ISOSpeedRatings': ['1250', '1350', '25']},
+                       index=pd.Index([f'/pictures/NEW_{i}.CR2' for i in range(3)], name='Filepath'))
+    model.upsert_data(pd.concat([batch, new]))
+    data.update(batch)
+    data = pd.concat([data, new])
+    assert shown(model) == expected(data)
+    assert model.data(model.index(0, 1)) == '3000'
+
+def test_fetch_more_past_chunk_size(monkeypatch):
+    # Without the model tester, which fetches every row itself
+    monkeypatch.setattr(models.PandasModel, 'chunk_size', 5)
+    model = models.PandasModel(catalog(12))
+    assert model.rowCount() == 5 and model.canFetchMore()
+    model.fetchMore()
+    model.fetchMore()
+    assert model.rowCount() == 12 and not model.canFetchMore()
+    model.fetchMore()
+    assert model.rowCount() == 12
+    assert model.data(model.index(11, 0)) == 'Light'
+    # Rows added once everything is shown wait for the next fetch
+    model.upsert_data(catalog(14).iloc[12:])
+    assert model.rowCount() == 12 and model.canFetchMore()
+    model.fetchMore()
+    assert model.rowCount() == 14
+
+def test_removed_rows_reset_the_model(checked):
+    data = catalog()
+    model = checked(data.copy())
+    model.sort(1, QtCore.Qt.DescendingOrder)
+    model.set_filter("FrameType == 'Light'")
+    resets = []
+    model.modelReset.connect(lambda: resets.append(True))
+    data = data.drop(data.index[[3, 5, 6]])
+    model.update_data(data.copy())
+    assert resets
+    assert shown(model) == expected(data)
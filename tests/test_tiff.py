@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import struct
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fixtures
+from modules import tiff
+
+def frame(make=fixtures.cr2_frame) -> tuple:
+    im = fixtures.pixels('Light', 64, 48, np.random.default_rng(0))
+    return im, make(im, *fixtures.exif_entries('Light', 800, 0))
+
+def test_preview_offsets_from_ifds():
+    # The preview is IFD0's single JPEG strip, the thumbnail IFD1's
+    # JPEGInterchangeFormat
+    im, data = frame()
+    preview = fixtures.jpeg_bytes(im)
+    thumb = fixtures.jpeg_bytes(np.ascontiguousarray(im[::4, ::4]))
+    ranges = sorted(tiff.jpeg_ranges(data), key=lambda r: r[1], reverse=True)
+    assert [length for offset, length in ranges] == [len(preview), len(thumb)]
+    assert data[ranges[0][0]:sum(ranges[0])] == preview
+    assert data[ranges[1][0]:sum(ranges[1])] == thumb
+    assert tiff.preview_ranges(data, len(data)) == sorted(ranges, key=lambda r: r[1])
+    assert tiff.preview_ranges(data, len(data), smallest=True) == [ranges[1]]
+    assert tiff.preview(data) == preview
+    assert tiff.preview(data, smallest=True) == thumb
+
+def test_uncompressed_tiff_has_no_preview():
+    im, data = frame(fixtures.tiff_frame)
+    assert tiff.ifds(data)
+    assert tiff.jpeg_ranges(data) == []
+    assert tiff.preview(data) is None
+
+def test_truncated_or_corrupt_input():
+    im, data = frame()
+    # JPEGs that run past the end of the file are left out
+    for size in (0, 8, 30, 300, len(data) // 2):
+        assert tiff.preview(data[:size]) is None
+    assert tiff.byte_order(b'PK\x03\x04') is None
+    # An IFD pointing at itself or past the end
+    looped = bytearray(data)
+    struct.pack_into('<I', looped, 4, len(data) + 100)
+    assert tiff.ifds(bytes(looped)) == []
+    first, = struct.unpack_from('<I', data, 4)
+    count, = struct.unpack_from('<H', data, first)
+    struct.pack_into('<I', looped, 4, first)
+    struct.pack_into('<I', looped, first + 2 + 12*count, first)
+    assert len(tiff.ifds(bytes(looped))) == 1
+
+def test_lossless_jpeg_is_not_decodable():
+    sof3 = b'\xff\xd8\xff\xc3\x00\x0b' + bytes(9)
+    assert not tiff.decodable_jpeg(sof3)
+    assert tiff.decodable_jpeg(fixtures.jpeg_bytes(np.zeros((8, 8, 3), dtype=np.uint8)))